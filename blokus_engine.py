@@ -0,0 +1,651 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------
+# BLOKUS Copyright 2015, Stephen Gould <stephen.gould@anu.edu.au>
+# -----------------------------------------------------------------------
+# Game engine for Blokus, a game developed by Bernard Tavitian and now
+# owned by Mattel. Pieces, players, the board, move generation, search
+# and scoring, without any plotting so that it can be imported quickly
+# (e.g., by worker processes running batch simulations). See blokus.py
+# for the animated front end.
+# -----------------------------------------------------------------------
+
+__author__ = "Stephen Gould"
+
+from collections import deque, namedtuple
+from copy import deepcopy
+import random
+import numpy as np
+
+# --- game definition ---------------------------------------------------
+
+NUM_ROWS = 20
+NUM_COLS = 20
+NUM_PLAYERS = 4
+
+# --- bitboards ---------------------------------------------------------
+#
+# A bitboard is a python int with bit y * ROW_STRIDE + x set for each occupied
+# cell (x, y). Each row is padded with an extra (always clear) column so that
+# shifting by one cell left or right cannot wrap onto the next row.
+
+ROW_STRIDE = NUM_COLS + 1
+BOARD_MASK = sum(((1 << NUM_COLS) - 1) << (y * ROW_STRIDE) for y in range(NUM_ROWS))
+
+def cell_bit(x, y):
+    """Returns the bitboard with only cell (x, y) set."""
+    return 1 << (y * ROW_STRIDE + x)
+
+def blocks_mask(blocks, x=0, y=0):
+    """Returns the bitboard of blocks placed at (x, y)."""
+    mask = 0
+    for (u, v) in blocks:
+        mask |= cell_bit(x + u, y + v)
+    return mask
+
+# positions (x, y) at which a width-by-height bounding box stays on the board
+POSITION_MASKS = {(w, h): sum(((1 << (NUM_COLS - w + 1)) - 1) << (y * ROW_STRIDE) for y in range(NUM_ROWS - h + 1))
+    for w in range(1, 6) for h in range(1, 6)}
+
+def bit_cells(bits):
+    """Returns the cell indices (y * ROW_STRIDE + x) set in a bitboard."""
+    cells = []
+    while bits:
+        low = bits & -bits
+        cells.append(low.bit_length() - 1)
+        bits ^= low
+    return cells
+
+def corner_rule_bits(occupied):
+    """Returns the bitboard of starting corners open to every player given the
+    occupied cells: the top-left corner until it is taken, then the right-hand
+    corners, and then also the bottom-left corner once one of those is taken."""
+    if not occupied & cell_bit(0, 0):
+        return cell_bit(0, 0)
+    bits = cell_bit(NUM_COLS - 1, 0) | cell_bit(NUM_COLS - 1, NUM_ROWS - 1)
+    if occupied & bits:
+        bits |= cell_bit(0, NUM_ROWS - 1)
+    return bits
+
+def edge_neighbours(bits):
+    """Returns the bitboard of cells sharing a side with a cell in bits."""
+    return ((bits << 1) | (bits >> 1) | (bits << ROW_STRIDE) | (bits >> ROW_STRIDE)) & BOARD_MASK
+
+def diag_neighbours(bits):
+    """Returns the bitboard of cells sharing a corner with a cell in bits."""
+    return ((bits << (ROW_STRIDE + 1)) | (bits << (ROW_STRIDE - 1)) |
+            (bits >> (ROW_STRIDE + 1)) | (bits >> (ROW_STRIDE - 1))) & BOARD_MASK
+
+# --- piece class -------------------------------------------------------
+
+Orientation = namedtuple('Orientation', ['blocks', 'width', 'height', 'corners', 'edges', 'mask'])
+Orientation.__doc__ = """One orientation of a piece. Blocks are (x, y) offsets normalised so that the
+bounding box (width-by-height) starts at (0, 0). Corners are the blocks that can
+touch another piece of the same colour diagonally and edges are the cells
+(outside the piece) that share a side with it. Mask is the bitboard of the
+blocks placed at (0, 0)."""
+
+def rotate(blocks):
+    """Rotate blocks by 90 degree clockwise."""
+    return tuple([(y, -x) for (x, y) in blocks])
+
+def flip(blocks):
+    """Flip blocks about the vertical axis."""
+    return tuple([(x, -y) for (x, y) in blocks])
+
+def make_orientation(blocks):
+    """Normalise blocks and precompute their bounding box, corners and edges."""
+    min_x, min_y = min(x for (x, y) in blocks), min(y for (x, y) in blocks)
+    blocks = tuple(sorted((x - min_x, y - min_y) for (x, y) in blocks))
+    cells = set(blocks)
+    corners = tuple((x, y) for (x, y) in blocks if any(
+        ((x + dx, y) not in cells) and ((x, y + dy) not in cells) for dx, dy in ((-1, -1), (1, -1), (-1, 1), (1, 1))))
+    edges = tuple(sorted(set((x + dx, y + dy) for (x, y) in blocks
+        for dx, dy in ((0, -1), (0, 1), (-1, 0), (1, 0))) - cells))
+    return Orientation(blocks, max(x for (x, y) in blocks) + 1, max(y for (x, y) in blocks) + 1, corners, edges,
+        blocks_mask(blocks))
+
+class Piece(object):
+    """Encapsulates a piece."""
+
+    blocks = ()       # coordinates of the blocks
+    rotations = 0     # number of unique orientations
+    symmetry = False  # mirror symmetry
+    orientations = () # unique orientations (immutable, computed once)
+
+    def __init__(self, blocks, rotations=4, symmetry=False):
+        assert blocks[0] == (0, 0)
+        self.blocks = blocks
+        self.rotations = rotations
+        self.symmetry = symmetry
+
+        orientations = []
+        for b in (blocks, flip(blocks)):
+            for r in range(4):
+                o = make_orientation(b)
+                if o not in orientations:
+                    orientations.append(o)
+                b = rotate(b)
+        assert len(orientations) == rotations * (1 if symmetry else 2)
+        self.orientations = tuple(orientations)
+
+    def __str__(self):
+        return str(self.blocks)
+
+    def size(self):
+        """Return the number of blocks in this piece."""
+        return len(self.blocks)
+
+# --- piece definitions -------------------------------------------------
+
+PIECE_DEFS = []
+PIECE_DEFS.append(Piece(((0, 0), ), 1, True))                                 # 1-by-1
+PIECE_DEFS.append(Piece(((0, 0), (1, 0)), 2, True))                           # 1-by-2
+PIECE_DEFS.append(Piece(((0, 0), (1, 0), (1, 1)), 4, True))                   # 3-corner
+PIECE_DEFS.append(Piece(((0, 0), (1, 0), (2, 0)), 2, True))                   # 1-by-3
+PIECE_DEFS.append(Piece(((0, 0), (1, 0), (1, 1), (0, 1)), 1, True))           # 2-by-2
+PIECE_DEFS.append(Piece(((0, 0), (1, 0), (2, 0), (1, 1)), 4, True))           # 4-tee
+PIECE_DEFS.append(Piece(((0, 0), (1, 0), (2, 0), (3, 0)), 2, True))           # 1-by-4
+PIECE_DEFS.append(Piece(((0, 0), (1, 0), (2, 0), (2, 1))))                    # 4-ell
+PIECE_DEFS.append(Piece(((0, 0), (1, 0), (1, 1), (2, 1)), 2))                 # 4-ess
+PIECE_DEFS.append(Piece(((0, 0), (1, 0), (2, 0), (3, 0), (3, 1))))            # 5-ell
+PIECE_DEFS.append(Piece(((0, 0), (1, 0), (2, 0), (1, 1), (1, 2)), 4, True))   # 5-tee
+PIECE_DEFS.append(Piece(((0, 0), (1, 0), (2, 0), (2, 1), (2, 2)), 4, True))   # 5-corner
+PIECE_DEFS.append(Piece(((0, 0), (1, 0), (1, 1), (2, 1), (3, 1))))            # 5-ess
+PIECE_DEFS.append(Piece(((0, 0), (0, 1), (1, 1), (2, 1), (2, 2)), 2))         # 5-ess'
+PIECE_DEFS.append(Piece(((0, 0), (1, 0), (2, 0), (3, 0), (4, 0)), 2, True))   # 1-by-5
+PIECE_DEFS.append(Piece(((0, 0), (0, 1), (1, 1), (1, 0), (0, 2))))            # 5
+PIECE_DEFS.append(Piece(((0, 0), (0, 1), (1, 1), (1, 2), (2, 2)), 4, True))   # 5
+PIECE_DEFS.append(Piece(((0, 0), (0, 1), (0, 2), (1, 0), (1, 2)), 4, True))   # 5-cee
+PIECE_DEFS.append(Piece(((0, 0), (1, 0), (1, 1), (1, 2), (2, 1))))            # 5
+PIECE_DEFS.append(Piece(((0, 0), (1, 0), (-1, 0), (0, 1), (0, -1)), 1, True)) # 5-plus
+PIECE_DEFS.append(Piece(((0, 0), (1, 0), (2, 0), (3, 0), (1, 1))))            # 5
+
+# --- player class ------------------------------------------------------
+
+class Player(object):
+    """Encapsulates a player agent."""
+
+    def __init__(self, id):
+        assert 1 <= id <= NUM_PLAYERS
+        self.id = id
+        self.pieces = list(range(len(PIECE_DEFS)))
+        self.last_played = None
+
+    def __getitem__(self, indx):
+        """Return the piece referenced by indx."""
+        return PIECE_DEFS[self.pieces[indx]]
+
+    def __len__(self):
+        return len(self.pieces)
+
+    def add_piece(self, piece_id):
+        """Add a piece to this player's set of pieces."""
+        self.pieces.append(piece_id)
+
+    def remove_piece(self, indx):
+        """Remove a piece from this player's set of piece. Returns a token for
+        undoing the removal."""
+        token = (indx, self.pieces[indx], self.last_played)
+        self.last_played = PIECE_DEFS[self.pieces[indx]]
+        del self.pieces[indx]
+        return token
+
+    def undo(self, token):
+        """Undo a piece removal given the token returned by remove_piece."""
+        indx, piece_id, self.last_played = token
+        self.pieces.insert(indx, piece_id)
+
+    def score(self):
+        """Computes the score for this player."""
+        if not self.pieces:
+            return 20 if self.last_played.size() == 1 else 15
+        return -1 * sum([PIECE_DEFS[i].size() for i in self.pieces])
+
+# --- board class -------------------------------------------------------
+
+EDGE_OFFSETS = np.array(((0, -1), (0, 1), (-1, 0), (1, 0)))
+DIAG_OFFSETS = np.array(((-1, -1), (1, -1), (-1, 1), (1, 1)))
+
+def neighbours(cells, offsets):
+    """Returns column and row indices of the on-board neighbours of an array of
+    (x, y) cells in the directions given by offsets."""
+    nbrs = (cells[:, np.newaxis, :] + offsets).reshape(-1, 2)
+    nbrs = nbrs[(nbrs[:, 0] >= 0) & (nbrs[:, 0] < NUM_COLS) & (nbrs[:, 1] >= 0) & (nbrs[:, 1] < NUM_ROWS)]
+    return nbrs[:, 0], nbrs[:, 1]
+
+class Board(object):
+    """Encapsulates a game board."""
+
+    def __init__(self, state = None):
+        if (state is not None):
+            assert state.shape == (NUM_ROWS, NUM_COLS)
+            self.board = np.copy(state)
+        else:
+            self.board = np.zeros((NUM_ROWS, NUM_COLS), dtype=np.byte)
+        self.cant_have_any_map = [None for p in range(NUM_PLAYERS)]
+        self.must_have_one_map = [None for p in range(NUM_PLAYERS)]
+        self.bits = [0 for p in range(NUM_PLAYERS)]
+        for p in range(NUM_PLAYERS):
+            rows, cols = np.nonzero(self.board == p + 1)
+            self.bits[p] = blocks_mask(zip(cols.tolist(), rows.tolist()))
+
+        # cells diagonal to a player's pieces that the player could cover next
+        # (excluding the starting corners), and cached legal moves for each player
+        occupied = self.occupied()
+        self.anchors = [set(bit_cells(diag_neighbours(bits) & ~(occupied | edge_neighbours(bits))))
+            for bits in self.bits]
+        self.legal_moves = [None for p in range(NUM_PLAYERS)]
+
+    def copy(self):
+        """Creates a copy of the board."""
+        b = Board(self.board)
+        b.cant_have_any_map = deepcopy(self.cant_have_any_map)
+        b.must_have_one_map = deepcopy(self.must_have_one_map)
+        b.legal_moves = list(self.legal_moves)
+        return b
+
+    def occupied(self):
+        """Returns the bitboard of all occupied cells."""
+        occupied = 0
+        for bits in self.bits:
+            occupied |= bits
+        return occupied
+
+    def get_bitboard_maps(self, player):
+        """Returns bitboards of the cells a player's next piece can't cover and of
+        the cells it must cover at least one of. Bitboard version of
+        get_validity_map."""
+
+        occupied = self.occupied()
+        forbidden = occupied | edge_neighbours(self.bits[player - 1])
+        corners = (diag_neighbours(self.bits[player - 1]) & ~occupied) | corner_rule_bits(occupied)
+        return forbidden, corners
+
+    def get_anchors(self, player, forbidden=None):
+        """Returns the set of cells one of which the player's next piece must
+        cover, i.e., the anchor set plus any open starting corners."""
+        if forbidden is None:
+            forbidden = self.get_bitboard_maps(player)[0]
+        return self.anchors[player - 1].union(bit_cells(corner_rule_bits(self.occupied()) & ~forbidden))
+
+    def moves_at_anchors(self, player, anchors, forbidden, pieces):
+        """Returns a dictionary of the legal moves for a player with the given
+        pieces that put a corner block of the piece on one of the anchors. Moves
+        are keyed by (piece_id, orientation index) and held as a bitboard of the
+        positions (x, y) at which the orientation can be placed. As in
+        expand_node_bitboard all positions of an orientation are tested at once."""
+        moves = {}
+        anchors = sum(1 << a for a in anchors)
+        free = ~forbidden & BOARD_MASK
+        for piece_id in pieces:
+            for k, o in enumerate(PIECE_DEFS[piece_id].orientations):
+                touches = 0
+                for (u, v) in o.corners:
+                    touches |= anchors >> (v * ROW_STRIDE + u)
+                legal = touches & POSITION_MASKS[o.width, o.height]
+                for (u, v) in o.blocks:
+                    if not legal:
+                        break
+                    legal &= free >> (v * ROW_STRIDE + u)
+                if legal:
+                    moves[piece_id, k] = legal
+        return moves
+
+    def get_legal_moves(self, player, pieces):
+        """Returns the (cached) dictionary of legal moves for a player with the
+        given pieces, as in moves_at_anchors. The cache is brought up to date
+        lazily: pieces no longer held are dropped, positions overlapping pieces
+        placed since (or touching the sides of the player's own new pieces) are
+        cleared, and moves at the player's new anchors are added."""
+        occupied, bits = self.occupied(), self.bits[player - 1]
+        pieces = frozenset(pieces)
+        cache = self.legal_moves[player - 1]
+        if (cache is not None) and (cache[1] & ~occupied == 0) and (corner_rule_bits(cache[1]) == corner_rule_bits(occupied)) \
+                and (cache[3] >= pieces):
+            moves, cached_occupied, cached_bits, cached_pieces = cache
+            if cached_occupied == occupied and cached_pieces == pieces:
+                return moves
+            own = bits & ~cached_bits
+            lost = (occupied & ~cached_occupied) | edge_neighbours(own)
+            updated = {}
+            for (piece_id, k), legal in moves.items():
+                if piece_id not in pieces:
+                    continue
+                if lost:
+                    for (u, v) in PIECE_DEFS[piece_id].orientations[k].blocks:
+                        legal &= ~(lost >> (v * ROW_STRIDE + u))
+                if legal:
+                    updated[piece_id, k] = legal
+            new_anchors = bit_cells(diag_neighbours(own) & ~(occupied | edge_neighbours(bits)))
+            if new_anchors:
+                for key, legal in self.moves_at_anchors(player, new_anchors, self.get_bitboard_maps(player)[0], pieces).items():
+                    updated[key] = updated.get(key, 0) | legal
+            moves = updated
+        else:
+            forbidden = self.get_bitboard_maps(player)[0]
+            moves = self.moves_at_anchors(player, self.get_anchors(player, forbidden), forbidden, pieces)
+
+        self.legal_moves[player - 1] = (moves, occupied, bits, pieces)
+        return moves
+
+    def get_free_cells(self, player=None):
+        """Returns list of free cells."""
+        cells = []
+        if player is None or self.cant_have_any_map[player - 1] is None:
+            for row in range(NUM_ROWS):
+                for col in range(NUM_COLS):
+                    if self.board[row, col] == 0:
+                        cells.append((col, row))
+        else:
+            for row in range(NUM_ROWS):
+                for col in range(NUM_COLS):
+                    if self.cant_have_any_map[player - 1][row, col] != 1:
+                        cells.append((col, row))
+
+        return cells
+
+    def get_validity_map(self, player):
+        """Returns a map of valid cell locations for a given player. Used internally
+        by is_legal_placement."""
+
+        occupied = self.board != 0
+        mine = np.pad(self.board == player, 1)
+        edge = mine[:-2, 1:-1] | mine[2:, 1:-1] | mine[1:-1, :-2] | mine[1:-1, 2:]
+        diag = mine[:-2, :-2] | mine[:-2, 2:] | mine[2:, :-2] | mine[2:, 2:]
+
+        cant_have_any_map = (occupied | edge).astype(np.byte)
+        must_have_one_map = (diag & ~occupied).astype(np.byte)
+
+        if self.board[0, 0] == 0:
+            must_have_one_map[0, 0] = 1
+        else:
+            must_have_one_map[0, -1] = 1
+            must_have_one_map[-1, -1] = 1
+            if (self.board[0, -1] != 0) or (self.board[-1, -1] != 0):
+                must_have_one_map[-1, 0] = 1
+
+        return cant_have_any_map, must_have_one_map
+
+    def get_validity_map_loops(self, player):
+        """Same as get_validity_map but loops over every cell. Kept for testing."""
+
+        cant_have_any_map  = np.zeros((NUM_ROWS, NUM_COLS), dtype=np.byte)
+        must_have_one_map  = np.zeros((NUM_ROWS, NUM_COLS), dtype=np.byte)
+        for row in range(NUM_ROWS):
+            for col in range(NUM_COLS):
+                if self.board[row, col] != 0:
+                    cant_have_any_map[row, col] = 1
+                else:
+                    if (row > 0) and (self.board[row - 1, col] == player):
+                        cant_have_any_map[row, col] = 1
+                    if (row + 1 < NUM_ROWS) and (self.board[row + 1, col] == player):
+                        cant_have_any_map[row, col] = 1
+                    if (col > 0) and (self.board[row, col - 1] == player):
+                        cant_have_any_map[row, col] = 1
+                    if (col + 1 < NUM_COLS) and (self.board[row, col + 1] == player):
+                        cant_have_any_map[row, col] = 1
+
+                    if (row > 0) and (col > 0) and (self.board[row - 1, col - 1] == player):
+                        must_have_one_map[row, col] = 1
+                    if (row > 0) and (col + 1 < NUM_COLS) and (self.board[row - 1, col + 1] == player):
+                        must_have_one_map[row, col] = 1
+                    if (row + 1 < NUM_ROWS) and (col > 0) and (self.board[row + 1, col - 1] == player):
+                        must_have_one_map[row, col] = 1
+                    if (row + 1 < NUM_ROWS) and (col + 1 < NUM_COLS) and (self.board[row + 1, col + 1] == player):
+                        must_have_one_map[row, col] = 1
+
+        if self.board[0, 0] == 0:
+            must_have_one_map[0, 0] = 1
+        else:
+            must_have_one_map[0, -1] = 1
+            must_have_one_map[-1, -1] = 1
+            if (self.board[0, -1] != 0) or (self.board[-1, -1] != 0):
+                must_have_one_map[-1, 0] = 1
+
+        return cant_have_any_map, must_have_one_map
+
+    def is_legal_placement(self, row, col, blocks, player):
+        """Check that piece placement is legal."""
+        assert 1 <= player <= NUM_PLAYERS
+
+        if ((self.cant_have_any_map[player - 1] is None) or (self.must_have_one_map[player - 1] is None)):
+            self.cant_have_any_map[player - 1], self.must_have_one_map[player - 1] = self.get_validity_map(player)
+
+        legal = False
+        for (x, y) in blocks:
+            u, v = col + x, row + y
+            if (0 <= u < NUM_COLS) and (0 <= v < NUM_ROWS):
+                if self.cant_have_any_map[player - 1][v, u]:
+                    return False
+                if self.must_have_one_map[player - 1][v, u]:
+                    legal = True
+            else:
+                return False
+
+        return legal
+
+    def place_piece(self, row, col, blocks, player):
+        """Place a piece on the board and update internal state. Returns a token
+        for undoing the placement."""
+        cells = np.array(blocks) + (col, row)
+        mask = blocks_mask(blocks, col, row)
+        occupied = self.occupied()
+        token = [player, cells, self.bits[player - 1], list(self.anchors), list(self.legal_moves)]
+        self.board[cells[:, 1], cells[:, 0]] = player
+        self.bits[player - 1] |= mask
+
+        # update anchors (cached legal moves are updated lazily by get_legal_moves)
+        covered = bit_cells(mask)
+        for p in range(NUM_PLAYERS):
+            self.anchors[p] = self.anchors[p].difference(covered)
+        self.anchors[player - 1].difference_update(bit_cells(edge_neighbours(mask)))
+        self.anchors[player - 1].update(
+            bit_cells(diag_neighbours(mask) & ~(occupied | mask | edge_neighbours(self.bits[player - 1]))))
+
+        # update validity maps, remembering the old values
+        undo_maps = []
+        if self.must_have_one_map[player - 1] is not None:
+            u, v = neighbours(cells, DIAG_OFFSETS)
+            undo_maps.append((self.must_have_one_map[player - 1], v, u, self.must_have_one_map[player - 1][v, u]))
+            self.must_have_one_map[player - 1][v, u] = 1
+
+        if self.cant_have_any_map[player - 1] is not None:
+            u, v = neighbours(cells, EDGE_OFFSETS)
+            undo_maps.append((self.cant_have_any_map[player - 1], v, u, self.cant_have_any_map[player - 1][v, u]))
+            self.cant_have_any_map[player - 1][v, u] = 1
+
+        for p in range(NUM_PLAYERS):
+            if self.cant_have_any_map[p] is not None:
+                v, u = cells[:, 1], cells[:, 0]
+                undo_maps.append((self.cant_have_any_map[p], v, u, self.cant_have_any_map[p][v, u]))
+                self.cant_have_any_map[p][v, u] = 1
+
+        token.append(undo_maps)
+        token.append([m is None for m in self.cant_have_any_map])
+        return token
+
+    def undo(self, token):
+        """Undo a piece placement given the token returned by place_piece."""
+        player, cells, self.bits[player - 1], self.anchors, self.legal_moves, undo_maps, no_maps = token
+        self.board[cells[:, 1], cells[:, 0]] = 0
+        for m, v, u, values in reversed(undo_maps):
+            m[v, u] = values
+
+        # maps computed after the placement are stale
+        for p in range(NUM_PLAYERS):
+            if no_maps[p]:
+                self.cant_have_any_map[p] = self.must_have_one_map[p] = None
+
+# --- game play ---------------------------------------------------------
+
+def leading_by(agents, player):
+    """Determine difference between player's score and closest opponent."""
+    scores = [a.score() for a in agents]
+    player_score = scores[player]
+    scores.sort()
+    if player_score == scores[-1]:
+        return player_score - scores[-2]
+    else:
+        return player_score - scores[-1]
+
+def winner(agents):
+    """Returns the winner and score difference to closest opponent."""
+    scores = sorted([(a.score(), a.id) for a in agents])
+    return (scores[-1][1], scores[-1][0] - scores[-2][0])
+
+def placements(orientation, cells):
+    """Generates positions that put the first block of an orientation on one of
+    the cells and keep its bounding box on the board."""
+    bx, by = orientation.blocks[0]
+    for cx, cy in cells:
+        x, y = cx - bx, cy - by
+        if (0 <= x <= NUM_COLS - orientation.width) and (0 <= y <= NUM_ROWS - orientation.height):
+            yield x, y
+
+BACKEND = 'bitboard'   # move generation backend: 'loops', 'numpy', 'bitboard' or 'anchors'
+
+def expand_node(board, agent, backend=None):
+    """Returns all legal moves (i, blocks, x, y) for an agent, where i indexes
+    the agent's remaining pieces."""
+    backend = backend or BACKEND
+    if backend == 'anchors':
+        return expand_node_anchors(board, agent)
+    if backend == 'bitboard':
+        return expand_node_bitboard(board, agent)
+    if backend == 'loops' and board.cant_have_any_map[agent.id - 1] is None:
+        board.cant_have_any_map[agent.id - 1], board.must_have_one_map[agent.id - 1] = \
+            board.get_validity_map_loops(agent.id)
+
+    children = deque()
+    cells = board.get_free_cells(agent.id)
+    for i in range(len(agent)):
+        #print(["-", "/", "|", "\\"][i % 4], end="\r")
+        for o in agent[i].orientations:
+            for x, y in placements(o, cells):
+                if board.is_legal_placement(y, x, o.blocks, agent.id):
+                    children.append((i, o.blocks, x, y))
+
+    return children
+
+def expand_node_bitboard(board, agent):
+    """Bitboard version of expand_node. Returns moves in the same order.
+
+    A move with bitboard mask is legal if (mask & forbidden) == 0 and
+    (mask & corners) != 0. Rather than testing each position in turn the test is
+    done for all positions of an orientation at once by shifting the free and
+    corner cells back by the offset of each block."""
+    children = deque()
+    forbidden, corners = board.get_bitboard_maps(agent.id)
+    free = ~forbidden & BOARD_MASK
+    for i in range(len(agent)):
+        for o in agent[i].orientations:
+            fits, touches = POSITION_MASKS[o.width, o.height], 0
+            for (u, v) in o.blocks:
+                offset = v * ROW_STRIDE + u
+                fits &= free >> offset
+                touches |= corners >> offset
+            legal = fits & touches
+            while legal:
+                low = legal & -legal
+                y, x = divmod(low.bit_length() - 1, ROW_STRIDE)
+                children.append((i, o.blocks, x, y))
+                legal ^= low
+
+    return children
+
+def expand_node_anchors(board, agent):
+    """Anchor version of expand_node using the board's cached legal moves.
+    Returns moves in the same order."""
+    children = deque()
+    moves = board.get_legal_moves(agent.id, agent.pieces)
+    for i, piece_id in enumerate(agent.pieces):
+        for k, o in enumerate(PIECE_DEFS[piece_id].orientations):
+            legal = moves.get((piece_id, k), 0)
+            while legal:
+                low = legal & -legal
+                y, x = divmod(low.bit_length() - 1, ROW_STRIDE)
+                children.append((i, o.blocks, x, y))
+                legal ^= low
+
+    return children
+
+def next_moves(board, agents, player, backend=None):
+    """Returns the player to move and their legal moves, skipping players that
+    have to pass. The list of moves is empty when the game is over."""
+    for k in range(NUM_PLAYERS):
+        moves = expand_node(board, agents[player], backend)
+        if moves:
+            return player, moves
+        player = (player + 1) % NUM_PLAYERS
+    return player, deque()
+
+def make_move(board, agents, player, move):
+    """Plays a move (i, blocks, x, y) for a player (indexed from zero). Returns a
+    token for undo_move."""
+    i, r, x, y = move
+    return player, board.place_piece(y, x, r, player + 1), agents[player].remove_piece(i)
+
+def undo_move(board, agents, token):
+    """Undoes a move given the token returned by make_move."""
+    player, board_token, agent_token = token
+    board.undo(board_token)
+    agents[player].undo(agent_token)
+
+def perft(board, agents, player, depth, backend=None):
+    """Counts the leaf nodes of the game tree to the given depth (in plies). A
+    player without a legal move passes, and a position where nobody can move is a
+    leaf."""
+    if depth == 0:
+        return 1
+
+    player, moves = next_moves(board, agents, player, backend)
+    if not moves:
+        return 1
+    if depth == 1:
+        return len(moves)
+
+    count = 0
+    for move in moves:
+        token = make_move(board, agents, player, move)
+        count += perft(board, agents, (player + 1) % NUM_PLAYERS, depth - 1, backend)
+        undo_move(board, agents, token)
+    return count
+
+def search_dfs(board, agents, player, max_depth=None, sample=None, statistics=None):
+    """Depth-first search over the game tree by making and unmaking moves on a
+    single board and set of agents, so memory is proportional to depth. Yields
+    the (live) board and agents at the end of every game, or after max_depth
+    moves. If sample is given at most that many randomly chosen moves are
+    explored at each node. Moves are explored last first."""
+
+    def children(player):
+        player, moves = next_moves(board, agents, player)
+        if statistics is not None:
+            statistics['moves_played'] += len(moves)
+        if sample is not None and len(moves) > sample:
+            moves = random.sample(list(moves), sample)
+        return player, list(moves)
+
+    stack = [children(player)]
+    tokens = []
+    if not stack[0][1]:
+        yield board, agents
+        return
+
+    while stack:
+        player, moves = stack[-1]
+        if not moves:
+            stack.pop()
+            if tokens:
+                undo_move(board, agents, tokens.pop())
+            continue
+
+        tokens.append(make_move(board, agents, player, moves.pop()))
+        if (max_depth is not None) and (len(tokens) == max_depth):
+            stack.append((player, []))
+            yield board, agents
+            continue
+
+        stack.append(children((player + 1) % NUM_PLAYERS))
+        if not stack[-1][1]:
+            yield board, agents
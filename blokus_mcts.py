@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------
+# BLOKUS MCTS Copyright 2015, Stephen Gould <stephen.gould@anu.edu.au>
+# -----------------------------------------------------------------------
+# Monte Carlo Tree Search agent for Blokus. Positions are identified by
+# Zobrist keys so that the search tree is really a graph: statistics for
+# a position reached by different move orders are shared through a
+# transposition table, which is kept from one move to the next. Playouts
+# work directly on bitboards rather than on a Board.
+# -----------------------------------------------------------------------
+
+__author__ = "Stephen Gould"
+
+import math
+import random
+import time
+
+from blokus_engine import NUM_ROWS, NUM_PLAYERS, ROW_STRIDE, BOARD_MASK, POSITION_MASKS, PIECE_DEFS
+from blokus_engine import bit_cells, corner_rule_bits, edge_neighbours, diag_neighbours
+from blokus_engine import next_moves, make_move, undo_move
+
+# --- zobrist keys ------------------------------------------------------
+
+# random keys for each (player, cell), each (player, piece played) and the
+# player to move, fixed so that keys agree between processes
+_rng = random.Random(2015)
+ZOBRIST_CELLS = [[_rng.getrandbits(64) for c in range(NUM_ROWS * ROW_STRIDE)] for p in range(NUM_PLAYERS)]
+ZOBRIST_PIECES = [[_rng.getrandbits(64) for i in range(len(PIECE_DEFS))] for p in range(NUM_PLAYERS)]
+ZOBRIST_PLAYER = [_rng.getrandbits(64) for p in range(NUM_PLAYERS)]
+del _rng
+
+def zobrist_key(board, agents, player):
+    """Returns the key of a position with the given player (indexed from zero)
+    to move."""
+    key = ZOBRIST_PLAYER[player]
+    for p in range(NUM_PLAYERS):
+        for c in bit_cells(board.bits[p]):
+            key ^= ZOBRIST_CELLS[p][c]
+        for i in set(range(len(PIECE_DEFS))).difference(agents[p].pieces):
+            key ^= ZOBRIST_PIECES[p][i]
+    return key
+
+def move_key(agents, player, move):
+    """Returns the change in key when player plays move (i, blocks, x, y) and
+    play passes to the next player."""
+    i, blocks, x, y = move
+    key = ZOBRIST_PIECES[player][agents[player].pieces[i]] ^ \
+        ZOBRIST_PLAYER[player] ^ ZOBRIST_PLAYER[(player + 1) % NUM_PLAYERS]
+    for (u, v) in blocks:
+        key ^= ZOBRIST_CELLS[player][(y + v) * ROW_STRIDE + x + u]
+    return key
+
+# --- playouts ----------------------------------------------------------
+
+def random_placement(bits, player, pieces, rng):
+    """Returns a random legal placement (piece_id, mask) for a player given the
+    bitboards of each player's pieces, or None if the player has to pass. Pieces
+    and orientations are tried in random order and a random position of the
+    first that fits is taken, which is much faster than generating all moves."""
+    occupied = bits[0] | bits[1] | bits[2] | bits[3]
+    forbidden = occupied | edge_neighbours(bits[player])
+    corners = (diag_neighbours(bits[player]) & ~occupied) | corner_rule_bits(occupied)
+    free = ~forbidden & BOARD_MASK
+    for piece_id in rng.sample(pieces, len(pieces)):
+        orientations = PIECE_DEFS[piece_id].orientations
+        k = rng.randrange(len(orientations))
+        for o in orientations[k:] + orientations[:k]:
+            touches = 0
+            for (u, v) in o.corners:
+                touches |= corners >> (v * ROW_STRIDE + u)
+            legal = touches & POSITION_MASKS[o.width, o.height]
+            for (u, v) in o.blocks:
+                if not legal:
+                    break
+                legal &= free >> (v * ROW_STRIDE + u)
+            if legal:
+                offset = rng.choice(bit_cells(legal))
+                return piece_id, o.mask << offset
+    return None
+
+def playout(board, agents, player, rng):
+    """Plays random moves from a position until nobody can move and returns the
+    reward for each player: one for a win, shared between tied players."""
+    bits = list(board.bits)
+    pieces = [list(a.pieces) for a in agents]
+    last = [None if a.last_played is None else a.last_played.size() for a in agents]
+    stuck = [not p for p in pieces]
+    while not all(stuck):
+        if not stuck[player]:
+            placement = random_placement(bits, player, pieces[player], rng)
+            if placement is None:
+                stuck[player] = True
+            else:
+                piece_id, mask = placement
+                bits[player] |= mask
+                pieces[player].remove(piece_id)
+                last[player] = PIECE_DEFS[piece_id].size()
+                stuck[player] = not pieces[player]
+        player = (player + 1) % NUM_PLAYERS
+
+    # as Player.score
+    scores = [(20 if last[p] == 1 else 15) if not pieces[p] else -sum(PIECE_DEFS[i].size() for i in pieces[p])
+        for p in range(NUM_PLAYERS)]
+    return rewards(scores)
+
+def rewards(scores):
+    """Reward of one for the highest score, shared between ties."""
+    best = max(scores)
+    winners = scores.count(best)
+    return [1.0 / winners if s == best else 0.0 for s in scores]
+
+# --- search ------------------------------------------------------------
+
+class Node(object):
+    """Statistics for a position in the transposition table. The total reward
+    is kept for every player so that each player maximises their own reward
+    when choosing a move from the position."""
+
+    __slots__ = ('player', 'moves', 'keys', 'visits', 'rewards', 'unvisited')
+
+    def __init__(self):
+        self.player = None      # player to move (after any passes)
+        self.moves = None       # legal moves, expanded on the second visit
+        self.keys = None        # key of the position after each move
+        self.visits = 0
+        self.rewards = [0.0] * NUM_PLAYERS
+        self.unvisited = 0      # moves before this index have been tried
+
+    def expand(self, board, agents, player, key, rng):
+        self.player, moves = next_moves(board, agents, player)
+        self.moves = list(moves)
+        rng.shuffle(self.moves)
+        self.moves.sort(key=lambda m: len(m[1]), reverse=True)     # try larger pieces first
+        passed = ZOBRIST_PLAYER[player] ^ ZOBRIST_PLAYER[self.player]
+        self.keys = [key ^ passed ^ move_key(agents, self.player, m) for m in self.moves]
+
+class MCTS(object):
+    """Monte Carlo Tree Search with UCT over a transposition table. The board
+    and agents are modified in place with make_move and restored with undo_move
+    after every simulation."""
+
+    def __init__(self, rng, exploration=0.7, max_nodes=1000000):
+        self.rng = rng
+        self.exploration = exploration
+        self.max_nodes = max_nodes
+        self.table = {}
+
+    def search(self, board, agents, player, simulations=None, time_limit=None):
+        """Runs simulations from the given position until the number of
+        simulations or time limit (in seconds) is reached. Returns the root node
+        and the number of simulations run."""
+        assert (simulations is not None) or (time_limit is not None)
+        if len(self.table) > self.max_nodes:
+            self.table.clear()
+
+        root_key = zobrist_key(board, agents, player)
+        root = self.table.setdefault(root_key, Node())
+        if root.moves is None:
+            root.expand(board, agents, player, root_key, self.rng)
+
+        deadline = None if time_limit is None else time.time() + time_limit
+        count = 0
+        while ((simulations is None) or (count < simulations)) and ((deadline is None) or (time.time() < deadline)):
+            self.simulate(board, agents, player, root_key)
+            count += 1
+        return root, count
+
+    def simulate(self, board, agents, player, key):
+        """Runs one simulation: select moves down the tree, add one new node,
+        play out the rest of the game at random and back up the rewards."""
+        node = self.table[key]
+        path, tokens = [node], []
+        while True:
+            if node.moves is None:
+                node.expand(board, agents, player, key, self.rng)
+            if not node.moves:
+                reward = rewards([a.score() for a in agents])
+                break
+
+            # try each move once before using the UCT rule
+            child = None
+            while node.unvisited < len(node.moves) and child is None:
+                k = node.unvisited
+                node.unvisited += 1
+                if key_visits(self.table, node.keys[k]) == 0:
+                    child = k
+            if child is None:
+                child = self.select(node)
+
+            tokens.append(make_move(board, agents, node.player, node.moves[child]))
+            player, key = (node.player + 1) % NUM_PLAYERS, node.keys[child]
+            if key not in self.table:
+                node = self.table[key] = Node()
+                path.append(node)
+                reward = playout(board, agents, player, self.rng)
+                break
+            node = self.table[key]
+            path.append(node)
+
+        for token in reversed(tokens):
+            undo_move(board, agents, token)
+        for node in path:
+            node.visits += 1
+            for p in range(NUM_PLAYERS):
+                node.rewards[p] += reward[p]
+
+    def select(self, node):
+        """Returns the index of the move maximising the UCT score for the player
+        to move."""
+        log_visits = math.log(node.visits + 1)     # children may have been reached by transposition
+        best, best_score = None, -1.0
+        for k, key in enumerate(node.keys):
+            child = self.table.get(key)
+            if (child is None) or (child.visits == 0):
+                return k
+            score = child.rewards[node.player] / child.visits + self.exploration * math.sqrt(log_visits / child.visits)
+            if score > best_score:
+                best, best_score = k, score
+        return best
+
+    def visit_counts(self, root):
+        """Returns a dictionary of the number of visits and total reward (for the
+        player to move) of each move from root."""
+        counts = {}
+        for m, k in zip(root.moves, root.keys):
+            node = self.table.get(k)
+            counts[m] = (0, 0.0) if node is None else (node.visits, node.rewards[root.player])
+        return counts
+
+def key_visits(table, key):
+    node = table.get(key)
+    return 0 if node is None else node.visits
+
+def search_root(args):
+    """Runs an independent search for root parallelism. Returns the visit
+    counts of each move and the number of simulations run."""
+    board, agents, player, simulations, time_limit, exploration, seed = args
+    mcts = MCTS(random.Random(seed), exploration)
+    root, count = mcts.search(board, agents, player, simulations, time_limit)
+    return mcts.visit_counts(root), count
+
+# --- agent -------------------------------------------------------------
+
+_pools = {}
+
+class MCTSAgent(object):
+    """Plays the most visited move after a Monte Carlo Tree Search with a budget
+    of simulations and/or seconds per move. With more than one worker each
+    worker process runs an independent search (sharing the budget of
+    simulations) and the visit counts are summed (root parallelism). Worker
+    processes can't start their own pools, so in that case the tournament
+    itself must be run with a single worker."""
+
+    def __init__(self, rng, simulations=200, time_limit=None, exploration=0.7, mcts_workers=1, **options):
+        self.rng = rng
+        self.simulations = simulations
+        self.time_limit = time_limit
+        self.exploration = exploration
+        self.workers = mcts_workers
+        self.mcts = MCTS(rng, exploration)
+        self.statistics = {'simulations': 0, 'search_time': 0.0, 'decisions': 0}
+
+    def select(self, board, agents, player, moves):
+        if len(moves) == 1:
+            return moves[0]
+
+        start_time = time.time()
+        if self.workers == 1:
+            root, count = self.mcts.search(board, agents, player, self.simulations, self.time_limit)
+            visits = self.mcts.visit_counts(root)
+        else:
+            import multiprocessing
+            if self.workers not in _pools:
+                _pools[self.workers] = multiprocessing.Pool(self.workers)
+            simulations = None if self.simulations is None else -(-self.simulations // self.workers)
+            jobs = [(board, agents, player, simulations, self.time_limit, self.exploration, self.rng.getrandbits(64))
+                for w in range(self.workers)]
+            visits, count = {}, 0
+            for v, n in _pools[self.workers].map(search_root, jobs):
+                count += n
+                for m, (n, r) in v.items():
+                    visits[m] = tuple(map(sum, zip(visits.get(m, (0, 0.0)), (n, r))))
+
+        self.statistics['simulations'] += count
+        self.statistics['search_time'] += time.time() - start_time
+        self.statistics['decisions'] += 1
+        # most visited move, breaking ties by mean reward
+        return max(moves, key=lambda m: (visits[m][0], visits[m][1] / max(visits[m][0], 1)) if m in visits else (0, 0.0))
+
+# ----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    import argparse
+    from blokus_engine import Board, Player
+
+    parser = argparse.ArgumentParser(description="BLOKUS MCTS: Times Monte Carlo Tree Search from the opening position.")
+    parser.add_argument('--simulations', type=int, default=1000, help='Number of simulations.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+    args = parser.parse_args()
+
+    board, agents = Board(), [Player(p + 1) for p in range(NUM_PLAYERS)]
+    mcts = MCTS(random.Random(args.seed))
+    start_time = time.time()
+    root, count = mcts.search(board, agents, 0, args.simulations)
+    runtime = time.time() - start_time
+    print("{} simulations in {:.1f}s ({:.0f} simulations/s), {} nodes".format(count, runtime, count / runtime,
+        len(mcts.table)))
+    visits = mcts.visit_counts(root)
+    for m in sorted(visits, key=visits.get, reverse=True)[:5]:
+        i, blocks, x, y = m
+        print("  piece {} at ({}, {}): {} visits, {:.3f} reward".format(agents[0].pieces[i], x, y, visits[m][0],
+            visits[m][1] / visits[m][0]))
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------
+# BLOKUS PERFT Copyright 2015, Stephen Gould <stephen.gould@anu.edu.au>
+# -----------------------------------------------------------------------
+# Benchmark suite for Blokus move generation. Counts the leaf nodes of
+# the game tree (perft) to a given depth from the initial board and from
+# a few mid-game positions with each move generation backend, checks
+# that the backends agree, and saves counts and timings as JSON so that
+# later runs can be compared against them.
+# -----------------------------------------------------------------------
+
+__author__ = "Stephen Gould"
+
+import json
+import platform
+import random
+import sys
+import time
+
+import numpy as np
+
+from blokus_engine import NUM_ROWS, NUM_COLS, NUM_PLAYERS, PIECE_DEFS, Board, Player, next_moves, make_move, perft
+from blokus_record import RecordReader, position, record_move
+
+BACKENDS = ('loops', 'numpy', 'bitboard', 'anchors')
+
+# benchmark positions as (seed, number of moves): reached by playing that
+# many random moves from the initial board (more positions can be taken from
+# recorded games)
+POSITIONS = {'initial': (0, 0), 'opening': (1, 8), 'midgame': (2, 24), 'endgame': (3, 48)}
+
+def play_random(seed, num_moves):
+    """Returns the board, agents and player to move after playing random
+    moves, and the moves played as blokus_record move records."""
+    rng = random.Random(seed)
+    board, agents = Board(), [Player(p + 1) for p in range(NUM_PLAYERS)]
+    player, history = 0, []
+    for k in range(num_moves):
+        player, moves = next_moves(board, agents, player, 'bitboard')
+        if not moves:
+            break
+        move = moves[rng.randrange(len(moves))]
+        history.append(record_move(agents, player, move))
+        make_move(board, agents, player, move)
+        player = (player + 1) % NUM_PLAYERS
+    return board, agents, player, history
+
+def run_suite(positions, depth, backends, verbose=True):
+    """Runs perft for each position (board, agents, player, history), depth and
+    backend, each from a board rebuilt from the history. Returns a dictionary of
+    results that can be saved as JSON."""
+    results = {'python': platform.python_version(), 'machine': platform.machine(),
+        'orientations': sum(len(p.orientations) for p in PIECE_DEFS), 'positions': {}}
+    for name, (board, agents, player, history) in positions.items():
+        entry = {'moves': [list(m) for m in history], 'player': player, 'depths': {}}
+        for d in range(1, depth + 1):
+            entry['depths'][d] = {}
+            for backend in backends:
+                # a fresh copy of the position each time, so that no backend
+                # reuses validity maps or move caches another one left behind
+                board, agents, _ = position(history)
+                start_time = time.process_time()
+                nodes = perft(board, agents, player, d, backend)
+                runtime = time.process_time() - start_time
+                entry['depths'][d][backend] = {'nodes': nodes, 'time': runtime, 'us_per_node': 1.0e6 * runtime / nodes}
+                if verbose:
+                    print("{:8} perft({}) = {:8} with {:8} backend in {:8.3f}s ({:8.1f}us per node)".format(name, d,
+                        nodes, backend, runtime, 1.0e6 * runtime / nodes))
+        results['positions'][name] = entry
+    return results
+
+def check_backends(results):
+    """Returns a list of (position, depth) where the backends disagree."""
+    errors = []
+    for name, entry in results['positions'].items():
+        for d, counts in entry['depths'].items():
+            if len(set(c['nodes'] for c in counts.values())) > 1:
+                errors.append((name, d))
+    return errors
+
+def compare(results, baseline):
+    """Compares results with a baseline run. Returns a list of differences in
+    node counts and prints the change in speed of each backend."""
+    errors = []
+    for name, entry in results['positions'].items():
+        if name not in baseline['positions']:
+            continue
+        if entry['moves'] != baseline['positions'][name]['moves']:
+            errors.append("{}: position differs from baseline".format(name))
+            continue
+        for d, counts in entry['depths'].items():
+            old_counts = baseline['positions'][name]['depths'].get(str(d), {})
+            for backend, c in counts.items():
+                if backend not in old_counts:
+                    continue
+                old = old_counts[backend]
+                if c['nodes'] != old['nodes']:
+                    errors.append("{} perft({}) with {}: {} nodes, baseline {}".format(name, d, backend,
+                        c['nodes'], old['nodes']))
+                print("{:8} perft({}) with {:8} backend: {:8.1f}us per node, baseline {:8.1f}us ({:.2f}x)".format(
+                    name, d, backend, c['us_per_node'], old['us_per_node'], old['us_per_node'] / c['us_per_node']))
+    return errors
+
+def check_maps(num_boards=20, seed=0, verbose=True):
+    """Checks the vectorised validity maps (Board.get_validity_map) against the
+    loops (Board.get_validity_map_loops), and the maps kept up to date by
+    place_piece against both, on random boards of 8 to 48 moves, and times the
+    two. Returns a list of differences."""
+    rng = random.Random(seed)
+    boards = []
+    for g in range(num_boards):
+        board, agents = Board(), [Player(p + 1) for p in range(NUM_PLAYERS)]
+        for p in range(NUM_PLAYERS):
+            # build the maps up front so that place_piece has to update them
+            board.cant_have_any_map[p], board.must_have_one_map[p] = board.get_validity_map(p + 1)
+        player = 0
+        for k in range(rng.randint(8, 48)):
+            player, moves = next_moves(board, agents, player, 'bitboard')
+            if not moves:
+                break
+            make_move(board, agents, player, moves[rng.randrange(len(moves))])
+            player = (player + 1) % NUM_PLAYERS
+        boards.append(board)
+
+    # the updated must_have_one maps may differ from fresh ones at cells that
+    # can't be covered anyway, and at the starting corners
+    corners = np.zeros((NUM_ROWS, NUM_COLS), dtype=bool)
+    corners[0, 0] = corners[0, -1] = corners[-1, 0] = corners[-1, -1] = True
+    errors = []
+    for g, board in enumerate(boards):
+        for player in range(1, NUM_PLAYERS + 1):
+            cant, must = board.get_validity_map(player)
+            cant_loops, must_loops = board.get_validity_map_loops(player)
+            if not (np.array_equal(cant, cant_loops) and np.array_equal(must, must_loops)):
+                errors.append("board {} player {}: vectorised validity maps differ from loops".format(g, player))
+            valid = (cant == 0) & ~corners
+            if not (np.array_equal(board.cant_have_any_map[player - 1], cant) and
+                    np.array_equal(board.must_have_one_map[player - 1][valid], must[valid])):
+                errors.append("board {} player {}: updated validity maps differ from fresh ones".format(g, player))
+
+    for fcn in (Board.get_validity_map_loops, Board.get_validity_map):
+        start_time = time.process_time()
+        for board in boards:
+            for player in range(1, NUM_PLAYERS + 1):
+                fcn(board, player)
+        if verbose:
+            print("{}: {:.3f}ms per map".format(fcn.__name__,
+                1000.0 * (time.process_time() - start_time) / (len(boards) * NUM_PLAYERS)))
+    return errors
+
+# ----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="BLOKUS PERFT: Move generation benchmark suite.")
+    parser.add_argument('--depth', type=int, default=2, help='Maximum perft depth.')
+    parser.add_argument('--backends', type=str, nargs='+', default=list(BACKENDS), choices=BACKENDS,
+        help='Move generation backends to run.')
+    parser.add_argument('--positions', type=str, nargs='+', default=list(POSITIONS.keys()), choices=POSITIONS.keys(),
+        help='Positions to run from.')
+    parser.add_argument('--record', type=str, default=None, help='Record file (see blokus_record) to take positions from.')
+    parser.add_argument('--record-positions', type=str, nargs='+', default=[],
+        help='Positions from the record file given as GAME:MOVES (the position after MOVES moves of GAME).')
+    parser.add_argument('--output', type=str, default=None, help='Save the results to a JSON file.')
+    parser.add_argument('--compare', type=str, default=None, help='Compare the results with a saved JSON file.')
+    parser.add_argument('--check-maps', default=False, action='store_true',
+        help='Only check the vectorised validity maps against the loops (and time them).')
+    args = parser.parse_args()
+
+    if args.check_maps:
+        errors = check_maps()
+        for e in errors:
+            print("ERROR: " + e)
+        sys.exit(1 if errors else 0)
+
+    print("{} unique piece orientations".format(sum(len(p.orientations) for p in PIECE_DEFS)))
+    positions = {name: play_random(*POSITIONS[name]) for name in args.positions}
+    if args.record_positions:
+        with RecordReader(args.record) as reader:
+            for spec in args.record_positions:
+                game, num_moves = map(int, spec.split(':'))
+                positions['game{}:{}'.format(game, num_moves)] = reader.position(game, num_moves)
+    results = run_suite(positions, args.depth, args.backends)
+
+    errors = ["{} perft({}): backends disagree".format(name, d) for name, d in check_backends(results)]
+    if args.compare is not None:
+        with open(args.compare) as f:
+            errors += compare(results, json.load(f))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+
+    for e in errors:
+        print("ERROR: " + e)
+    sys.exit(1 if errors else 0)
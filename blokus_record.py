@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------
+# BLOKUS RECORD Copyright 2015, Stephen Gould <stephen.gould@anu.edu.au>
+# -----------------------------------------------------------------------
+# Compact binary records of Blokus games. A record file starts with a
+# short header and then holds one game after another: the game's seed
+# and number of moves, then three bytes per move packing the player,
+# piece, orientation and position. An index file alongside holds the
+# offset of each game so that any position of any game can be rebuilt
+# by seeking to the game and replaying only its first moves.
+# -----------------------------------------------------------------------
+
+__author__ = "Stephen Gould"
+
+import os
+import struct
+
+from blokus_engine import NUM_PLAYERS, PIECE_DEFS, Board, Player, make_move
+
+MAGIC = b"BLKR"
+VERSION = 1
+FILE_HEADER = struct.Struct("<4sB")     # magic, version
+GAME_HEADER = struct.Struct("<QB")      # seed, number of moves
+INDEX_ENTRY = struct.Struct("<Q")       # offset of a game in the record file
+MOVE_SIZE = 3
+
+# --- moves -------------------------------------------------------------
+
+def record_move(agents, player, move):
+    """Returns the record (player, piece_id, orientation, x, y) of an engine
+    move (i, blocks, x, y) before it is played."""
+    i, blocks, x, y = move
+    piece_id = agents[player].pieces[i]
+    orientation = [o.blocks for o in PIECE_DEFS[piece_id].orientations].index(blocks)
+    return player, piece_id, orientation, x, y
+
+def engine_move(agents, record):
+    """Returns the player and engine move (i, blocks, x, y) for a move record."""
+    player, piece_id, orientation, x, y = record
+    return player, (agents[player].pieces.index(piece_id), PIECE_DEFS[piece_id].orientations[orientation].blocks, x, y)
+
+def encode_move(record):
+    """Packs a move record into three bytes: 2 bits of player, 5 bits each of
+    piece, x and y, and 3 bits of orientation."""
+    player, piece_id, orientation, x, y = record
+    return (player | piece_id << 2 | orientation << 7 | x << 10 | y << 15).to_bytes(MOVE_SIZE, 'little')
+
+def decode_move(data):
+    """Unpacks a move record packed by encode_move."""
+    bits = int.from_bytes(data, 'little')
+    return bits & 0x3, (bits >> 2) & 0x1f, (bits >> 7) & 0x7, (bits >> 10) & 0x1f, (bits >> 15) & 0x1f
+
+def replay(records, board=None, agents=None):
+    """Plays the move records on a (new) board and set of agents. Yields the
+    live board, agents and player to move before the first move and after each
+    move."""
+    if board is None:
+        board, agents = Board(), [Player(p + 1) for p in range(NUM_PLAYERS)]
+    player = 0
+    yield board, agents, player
+    for record in records:
+        player, move = engine_move(agents, record)
+        make_move(board, agents, player, move)
+        player = (player + 1) % NUM_PLAYERS
+        yield board, agents, player
+
+def position(records):
+    """Returns the board, agents and player to move after playing the records."""
+    for board, agents, player in replay(records):
+        pass
+    return board, agents, player
+
+# --- files -------------------------------------------------------------
+
+class RecordWriter(object):
+    """Appends games to a record file and its index (filename + ".idx")."""
+
+    def __init__(self, filename):
+        self.record = open(filename, 'ab')
+        self.index = open(filename + ".idx", 'ab')
+        if self.record.tell() == 0:
+            self.record.write(FILE_HEADER.pack(MAGIC, VERSION))
+
+    def write_game(self, records, seed=0):
+        """Appends a game given its list of move records."""
+        self.index.write(INDEX_ENTRY.pack(self.record.tell()))
+        self.record.write(GAME_HEADER.pack(seed, len(records)))
+        self.record.write(b"".join(encode_move(r) for r in records))
+
+    def close(self):
+        self.record.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class RecordReader(object):
+    """Random access to the games in a record file through its index."""
+
+    def __init__(self, filename):
+        self.record = open(filename, 'rb')
+        self.index = open(filename + ".idx", 'rb')
+        magic, version = FILE_HEADER.unpack(self.record.read(FILE_HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a version {} Blokus record file".format(filename, VERSION))
+        self.num_games = os.fstat(self.index.fileno()).st_size // INDEX_ENTRY.size
+
+    def __len__(self):
+        return self.num_games
+
+    def read_game(self, game, num_moves=None):
+        """Returns the seed and the (first num_moves) move records of a game."""
+        if not 0 <= game < self.num_games:
+            raise IndexError("game {} not in record file of {} games".format(game, self.num_games))
+        self.index.seek(game * INDEX_ENTRY.size)
+        self.record.seek(INDEX_ENTRY.unpack(self.index.read(INDEX_ENTRY.size))[0])
+        seed, length = GAME_HEADER.unpack(self.record.read(GAME_HEADER.size))
+        if num_moves is not None:
+            length = min(length, num_moves)
+        data = self.record.read(length * MOVE_SIZE)
+        return seed, [decode_move(data[k:k + MOVE_SIZE]) for k in range(0, len(data), MOVE_SIZE)]
+
+    def position(self, game, num_moves=None):
+        """Returns the board, agents and player to move after the first num_moves
+        moves of a game (or at the end of the game), and the moves played."""
+        seed, records = self.read_game(game, num_moves)
+        return position(records) + (records,)
+
+    def games(self):
+        """Generates the seed and move records of every game."""
+        for game in range(self.num_games):
+            yield self.read_game(game)
+
+    def close(self):
+        self.record.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+# ----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="BLOKUS RECORD: Summarises a file of recorded Blokus games.")
+    parser.add_argument('filename', type=str, help='Record file.')
+    parser.add_argument('--game', type=int, default=None, help='Print the moves and final scores of a game.')
+    args = parser.parse_args()
+
+    with RecordReader(args.filename) as reader:
+        print("{} games, {} bytes".format(len(reader), os.path.getsize(args.filename)))
+        if args.game is not None:
+            seed, records = reader.read_game(args.game)
+            print("game {} (seed {}), {} moves".format(args.game, seed, len(records)))
+            for player, piece_id, orientation, x, y in records:
+                print("  player {} piece {} orientation {} at ({}, {})".format(player + 1, piece_id, orientation, x, y))
+            board, agents, player = position(records)
+            print("scores: {}".format(", ".join(str(a.score()) for a in agents)))
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -----------------------------------------------------------------------
+# BLOKUS TOURNAMENT Copyright 2015, Stephen Gould <stephen.gould@anu.edu.au>
+# -----------------------------------------------------------------------
+# Plays many headless games of Blokus between computer agents across a
+# pool of worker processes. Each game is streamed as a line of JSON and
+# statistics (win rates per seat and per agent, score distributions and
+# game lengths) are reported at the end.
+# -----------------------------------------------------------------------
+
+__author__ = "Stephen Gould"
+
+import json
+import random
+import statistics
+import sys
+import time
+
+from blokus_engine import NUM_PLAYERS, Board, Player, next_moves, make_move, winner, leading_by
+from blokus_mcts import MCTSAgent
+from blokus_record import RecordWriter, record_move
+
+# --- agents ------------------------------------------------------------
+
+class RandomAgent(object):
+    """Plays a legal move chosen uniformly at random."""
+
+    def __init__(self, rng, **options):
+        self.rng = rng
+
+    def select(self, board, agents, player, moves):
+        return moves[self.rng.randrange(len(moves))]
+
+class GreedyAgent(object):
+    """Plays one of the largest pieces that fits, chosen at random."""
+
+    def __init__(self, rng, **options):
+        self.rng = rng
+
+    def select(self, board, agents, player, moves):
+        size = max(len(m[1]) for m in moves)
+        return self.rng.choice([m for m in moves if len(m[1]) == size])
+
+AGENTS = {'random': RandomAgent, 'greedy': GreedyAgent, 'mcts': MCTSAgent}
+
+# --- games -------------------------------------------------------------
+
+def play_game(game, seed, lineup, options=None, backend=None, record=False):
+    """Plays a game between the agents named in lineup (one per seat) and
+    returns a dictionary of results, including the move records (see
+    blokus_record) if record is set. All randomness is drawn from the seed so
+    that games can be replayed."""
+
+    rng = random.Random(seed)
+    policies = [AGENTS[name](random.Random(rng.getrandbits(64)), **(options or {})) for name in lineup]
+    board, agents = Board(), [Player(p + 1) for p in range(NUM_PLAYERS)]
+
+    start_time = time.process_time()
+    player, num_moves, history = 0, 0, []
+    while True:
+        player, moves = next_moves(board, agents, player, backend)
+        if not moves:
+            break
+        move = policies[player].select(board, agents, player, moves)
+        if record:
+            history.append(record_move(agents, player, move))
+        make_move(board, agents, player, move)
+        player = (player + 1) % NUM_PLAYERS
+        num_moves += 1
+
+    win_player, win_by = winner(agents)
+    return {'game': game, 'seed': seed, 'agents': list(lineup),
+        'scores': [a.score() for a in agents],
+        'leading_by': [leading_by(agents, p) for p in range(NUM_PLAYERS)],
+        'pieces_left': [len(a) for a in agents],
+        'winner': win_player if win_by > 0 else None, 'moves': num_moves,
+        'time': time.process_time() - start_time,
+        'statistics': [getattr(policy, 'statistics', None) for policy in policies],
+        'history': history if record else None}
+
+def play_game_args(args):
+    return play_game(*args)
+
+def schedule(num_games, seed, lineup, rotate=False, options=None, backend=None, record=False):
+    """Returns the arguments to play_game for each game. If rotate is set the
+    lineup is rotated by one seat every game so that each agent plays from
+    every seat."""
+    games = []
+    for g in range(num_games):
+        k = g % NUM_PLAYERS if rotate else 0
+        games.append((g, seed + g, lineup[k:] + lineup[:k], options, backend, record))
+    return games
+
+def play_tournament(games, workers=None, output=None):
+    """Plays games on a pool of worker processes (in this process if workers is
+    one), writing each result as a line of JSON to output as it finishes.
+    Returns the results ordered by game."""
+
+    results = []
+
+    def record(result):
+        results.append(result)
+        if output is not None:
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+        print("\r...{} of {} games".format(len(results), len(games)), end="", file=sys.stderr)
+
+    if workers == 1:
+        for args in games:
+            record(play_game_args(args))
+    else:
+        import multiprocessing
+        with multiprocessing.Pool(workers) as pool:
+            for result in pool.imap_unordered(play_game_args, games, chunksize=1):
+                record(result)
+    print("", file=sys.stderr)
+
+    return sorted(results, key=lambda r: r['game'])
+
+# --- statistics --------------------------------------------------------
+
+def describe(values):
+    """Summary statistics of a list of numbers."""
+    q = statistics.quantiles(values, n=4, method='inclusive') if len(values) > 1 else values * 3
+    return "mean {:6.1f}, std {:5.1f}, min {:4}, q1 {:6.1f}, median {:6.1f}, q3 {:6.1f}, max {:4}".format(
+        statistics.mean(values), statistics.pstdev(values), min(values), q[0], q[1], q[2], max(values))
+
+def summarise(results, wall_time=None, workers=1, file=sys.stdout):
+    """Prints win rates per seat and per agent, score distributions and game
+    lengths for a list of game results."""
+
+    num_games = len(results)
+    ties = sum(1 for r in results if r['winner'] is None)
+    print("{} games, {} tied".format(num_games, ties), file=file)
+
+    print("seat  wins  win rate  score", file=file)
+    for p in range(NUM_PLAYERS):
+        wins = sum(1 for r in results if r['winner'] == p + 1)
+        print("{:4}  {:4}  {:8.3f}  {}".format(p + 1, wins, wins / num_games,
+            describe([r['scores'][p] for r in results])), file=file)
+
+    names = sorted(set(name for r in results for name in r['agents']))
+    print("agent       seats  wins  win rate  score", file=file)
+    for name in names:
+        seats = [(r, p) for r in results for p in range(NUM_PLAYERS) if r['agents'][p] == name]
+        wins = sum(1 for r, p in seats if r['winner'] == p + 1)
+        print("{:10}  {:5}  {:4}  {:8.3f}  {}".format(name, len(seats), wins, wins / len(seats),
+            describe([r['scores'][p] for r, p in seats])), file=file)
+
+    for name in names:
+        stats = [r['statistics'][p] for r in results for p in range(NUM_PLAYERS)
+            if r['agents'][p] == name and r.get('statistics') and r['statistics'][p]]
+        if stats and 'simulations' in stats[0]:
+            simulations, search_time = sum(s['simulations'] for s in stats), sum(s['search_time'] for s in stats)
+            decisions = sum(s['decisions'] for s in stats)
+            print("{}: {:.0f} simulations/s, {:.0f} simulations and {:.2f}s per move".format(name,
+                simulations / search_time, simulations / decisions, search_time / decisions), file=file)
+
+    print("game length: {}".format(describe([r['moves'] for r in results])), file=file)
+
+    cpu_time = sum(r['time'] for r in results)
+    print("{:.1f} games/s/core ({:.1f}ms per game)".format(num_games / cpu_time, 1000.0 * cpu_time / num_games), file=file)
+    if wall_time is not None:
+        print("{:.1f} games/s with {} workers in {:.1f}s".format(num_games / wall_time, workers, wall_time), file=file)
+
+# ----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    import argparse
+    import multiprocessing
+
+    parser = argparse.ArgumentParser(description="BLOKUS TOURNAMENT: Plays games of Blokus between computer agents.")
+    parser.add_argument('--games', type=int, default=100, help='Number of games to play.')
+    parser.add_argument('--agents', type=str, nargs='+', default=['random'], choices=sorted(AGENTS.keys()),
+        help='Agent for each seat (repeated to fill all {} seats).'.format(NUM_PLAYERS))
+    parser.add_argument('--rotate', default=False, action='store_true',
+        help='Rotate the agents one seat every game so that each plays from every seat.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the first game (game g uses seed + g).')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: number of CPUs).')
+    parser.add_argument('--backend', type=str, default=None, help='Move generation backend (default: blokus_engine.BACKEND).')
+    parser.add_argument('--simulations', type=int, default=200, help='MCTS simulations per move (0 for no limit).')
+    parser.add_argument('--time-limit', type=float, default=None, help='MCTS time limit per move in seconds.')
+    parser.add_argument('--exploration', type=float, default=0.7, help='MCTS exploration constant.')
+    parser.add_argument('--mcts-workers', type=int, default=1,
+        help='MCTS root parallelism (needs --workers 1 since pool workers cannot start their own pools).')
+    parser.add_argument('--output', type=str, default='-', help='File to write JSON lines of game results to ("-" for stdout).')
+    parser.add_argument('--record', type=str, default=None,
+        help='Append the games (in order) to a binary record file (see blokus_record).')
+    parser.add_argument('--summarise', type=str, default=None, help='Summarise an existing file of results instead of playing.')
+    args = parser.parse_args()
+
+    if args.summarise is not None:
+        with open(args.summarise) as f:
+            summarise([json.loads(line) for line in f if line.strip()])
+        exit(0)
+
+    lineup = [args.agents[p % len(args.agents)] for p in range(NUM_PLAYERS)]
+    workers = args.workers or multiprocessing.cpu_count()
+    if args.mcts_workers > 1 and workers > 1:
+        parser.error("--mcts-workers needs --workers 1")
+    if not args.simulations and args.time_limit is None:
+        parser.error("--simulations 0 needs --time-limit")
+    options = {'simulations': args.simulations or None,
+        'time_limit': args.time_limit, 'exploration': args.exploration, 'mcts_workers': args.mcts_workers}
+    games = schedule(args.games, args.seed, lineup, args.rotate, options, args.backend, args.record is not None)
+
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+    start_time = time.time()
+    results = play_tournament(games, workers, output)
+    wall_time = time.time() - start_time
+    if output is not sys.stdout:
+        output.close()
+    if args.record is not None:
+        with RecordWriter(args.record) as writer:
+            for r in results:
+                writer.write_game(r['history'], r['seed'])
+
+    summarise(results, wall_time, workers, sys.stderr if output is sys.stdout else sys.stdout)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""ASGI variant of the booking calendar, adding a server-sent events stream.
+
+Every route of passenger_wsgi.py is served by its WSGI application, run on a
+worker thread, so the two can't drift apart. On top of that, GET /api/events
+keeps a connection open per browser tab and pushes a `change` event, with the
+new data version and the dates that changed, as soon as a write commits.
+
+Run it with any ASGI server (e.g. `uvicorn asgi:application`) or, for local
+testing, with `python3 server.py --asgi`. Under Passenger, which only speaks
+WSGI, /api/events is a 404 and the frontend keeps polling instead.
+"""
+
+import asyncio
+import io
+import json
+import sqlite3
+
+import passenger_wsgi as app
+
+EVENTS_QUEUE = 64  # events buffered per client before it misses some
+EVENTS_KEEPALIVE = 15  # seconds between comments that keep idle connections open
+EVENTS_CHECK_SECONDS = 5  # how often to look for writes made by other processes
+EVENTS_RETRY_MS = 5000  # how long browsers wait before reconnecting
+
+
+# ---- WSGI bridge ----
+
+def make_environ(scope, body):
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': (scope.get('server') or ('localhost', 80))[0],
+        'SERVER_PORT': str((scope.get('server') or ('localhost', 80))[1]),
+        'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+        'REMOTE_ADDR': (scope.get('client') or ('unknown', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': io.StringIO(),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        'CONTENT_LENGTH': str(len(body)),
+    }
+    for name, value in scope.get('headers', []):
+        name, value = name.decode('latin-1').upper().replace('-', '_'), value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f'HTTP_{name}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def call_wsgi(environ):
+    """Run the WSGI application to completion; returns status, headers, body."""
+    response = []
+    chunks = app.application(environ, lambda status, headers, exc_info=None: response.extend([status, headers]))
+    try:
+        body = b''.join(chunks)
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+    return response[0], response[1], body
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def send_wsgi(scope, receive, send):
+    environ = make_environ(scope, await read_body(receive))
+    status, headers, body = await asyncio.to_thread(call_wsgi, environ)
+    await send({
+        'type': 'http.response.start',
+        'status': int(status.split()[0]),
+        'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+# ---- change events ----
+
+def read_changes(since):
+    """The data version and epoch, and the dates changed after version since
+    (None if the change log no longer reaches back that far)."""
+    conn = app.get_db()
+    settings = dict(conn.execute(
+        "SELECT key, value FROM settings WHERE key IN ('data_version', 'data_epoch', 'changes_floor')"))
+    version = int(settings.get('data_version', 0))
+    dates = None
+    if since is not None and since >= int(settings.get('changes_floor', 0)) and since <= version:
+        dates = [row[0] for row in conn.execute('SELECT date FROM changes WHERE version > ?', (since,))]
+    return version, settings.get('data_epoch', ''), dates
+
+
+class Broadcaster:
+    """Fans change events out to a queue per connected client. Writes made in
+    this process wake it straight away; writes made by other processes (or
+    set_password.py, or a shell) are found every EVENTS_CHECK_SECONDS, so the
+    database is checked once per process rather than once per tab."""
+
+    def __init__(self):
+        self.clients = set()
+        self.version = None
+        self.wake = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+        app.add_change_listener(lambda version, dates: self.loop.call_soon_threadsafe(self.wake.set))
+        self.task = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        while True:
+            try:
+                version, epoch, dates = await asyncio.to_thread(read_changes, self.version)
+            except sqlite3.Error:
+                pass  # busy; look again next time
+            else:
+                if self.version is not None and version != self.version:
+                    self.publish({'version': version, 'epoch': epoch, 'dates': dates})
+                self.version = version
+            try:
+                await asyncio.wait_for(self.wake.wait(), EVENTS_CHECK_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+
+    def publish(self, event):
+        for queue in self.clients:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                pass  # events are only hints: the client's next sync fetches everything since its version
+
+    def subscribe(self):
+        queue = asyncio.Queue(EVENTS_QUEUE)
+        self.clients.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.clients.discard(queue)
+
+
+_broadcaster = None
+
+
+def get_broadcaster():
+    global _broadcaster
+    if _broadcaster is None:
+        _broadcaster = Broadcaster()
+    return _broadcaster
+
+
+def sse_message(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'.encode('utf-8')
+
+
+async def handle_events(scope, receive, send):
+    environ = make_environ(scope, b'')
+    authed = await asyncio.to_thread(lambda: app.is_authenticated(app.get_db(), environ))
+    if not authed:
+        await send({'type': 'http.response.start', 'status': 401,
+                    'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body', 'body': json.dumps({'error': 'unauthorized'}).encode('utf-8')})
+        return
+
+    broadcaster = get_broadcaster()
+    queue = broadcaster.subscribe()
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),  # stop nginx in front from holding events back
+        ]})
+        await send({'type': 'http.response.body', 'body': f'retry: {EVENTS_RETRY_MS}\n\n'.encode(), 'more_body': True})
+        while not disconnected.done():
+            get = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({get, disconnected}, timeout=EVENTS_KEEPALIVE,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if get in done:
+                chunk = sse_message('change', get.result())
+            else:
+                get.cancel()
+                chunk = b': keepalive\n\n'
+            if not disconnected.done():
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    except OSError:
+        pass  # the client went away mid-send
+    finally:
+        broadcaster.unsubscribe(queue)
+        disconnected.cancel()
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+# ---- application ----
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    if scope['path'] == '/api/events' and scope['method'] == 'GET':
+        return await handle_events(scope, receive, send)
+    return await send_wsgi(scope, receive, send)
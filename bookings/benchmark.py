@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""Benchmark the booking calendar's API.
+
+Builds a throwaway database with a range of designated days and a logged-in
+session, then calls the WSGI application in-process (no network or HTTP
+parsing) as fast as it can and reports requests per second:
+
+    python3 benchmark.py [--days 400] [--seconds 2]
+"""
+
+import argparse
+import datetime
+import io
+import itertools
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+
+def seed(app, num_days):
+    conn = app.connect()
+    start = datetime.date(2024, 1, 1)
+    statuses = sorted(app.VALID_STATUSES)
+    dates = [(start + datetime.timedelta(days=i)).isoformat() for i in range(num_days)]
+    with conn:
+        for i, d in enumerate(dates):
+            comment = f'note {i}' if i % 7 == 0 else None
+            conn.execute('INSERT OR REPLACE INTO designations (date, status, comment) VALUES (?, ?, ?)',
+                         (d, statuses[i % len(statuses)], comment))
+        app.log_changes(conn, dates)
+        conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('password_hash', ?)",
+                     (app.hash_password('benchmark'),))
+        token, _ = app.create_session(conn)
+    conn.close()
+    return token
+
+
+def make_environ(token, path, method='GET', query='', body=None, headers=None):
+    raw = b'' if body is None else body
+    environ = {
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'CONTENT_LENGTH': str(len(raw)),
+        'HTTP_COOKIE': f'session={token}',
+        'REMOTE_ADDR': '127.0.0.1',
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(raw),
+    }
+    environ.update(headers or {})
+    return environ
+
+
+def request(app, environ):
+    status = []
+    body = b''.join(app.application(environ, lambda s, h: status.append(s)))
+    return status[0], body
+
+
+def run(app, label, make, seconds):
+    """Call the app with environs from make() for the given time; print and
+    return requests per second."""
+    count = 0
+    status, body = request(app, make())
+    end = time.perf_counter() + seconds
+    start = time.perf_counter()
+    while time.perf_counter() < end:
+        request(app, make())
+        count += 1
+    rate = count / (time.perf_counter() - start)
+    print(f'{label:48} {rate:9.0f} req/s  ({status}, {len(body)} bytes)')
+    return rate
+
+
+def writes(token, path, num_dates, payloads):
+    """Environs that POST each payload in turn for the first num_dates days."""
+    start = datetime.date(2024, 1, 1)
+    dates = [(start + datetime.timedelta(days=i)).isoformat() for i in range(num_dates)]
+    bodies = itertools.cycle([json.dumps(dict(p, dates=dates)).encode() for p in payloads])
+    return lambda: make_environ(token, path, 'POST', body=next(bodies))
+
+
+def per_request_db(app):
+    """get_db as it used to be: a new connection, and the schema statements,
+    on every request."""
+    state = {}
+
+    def get_db():
+        if 'conn' in state:
+            state['conn'].close()
+        conn = state['conn'] = sqlite3.connect(app.DB_PATH)
+        for statement in app.SCHEMA:
+            conn.execute(statement)
+        return conn
+
+    return get_db
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the booking calendar API in-process.')
+    parser.add_argument('--days', type=int, default=400, help='number of designated days in the database')
+    parser.add_argument('--seconds', type=float, default=2.0, help='time to run each benchmark for')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ['BOOKINGS_DB'] = os.path.join(tmp, 'bookings.db')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import passenger_wsgi as app
+
+    token = seed(app, args.days)
+    days = lambda: make_environ(token, '/api/days')
+
+    get_db = app.get_db
+    app.get_db = per_request_db(app)
+    run(app, 'GET /api/days (connection per request)', days, args.seconds)
+    app.get_db = get_db
+    run(app, 'GET /api/days (persistent connection)', days, args.seconds)
+
+    run(app, 'GET /api/days?from=&to= (one month)',
+        lambda: make_environ(token, '/api/days', query='from=2024-03-01&to=2024-03-31'), args.seconds)
+
+    etag = app.get_data_etag(app.get_db())
+    not_modified = lambda: make_environ(token, '/api/days', headers={'HTTP_IF_NONE_MATCH': etag})
+    cache_size = app.SESSION_CACHE_SIZE
+    app.SESSION_CACHE_SIZE = 0
+    app.invalidate_session(token)
+    run(app, 'GET /api/days If-None-Match (no session cache)', not_modified, args.seconds)
+    app.SESSION_CACHE_SIZE = cache_size
+    run(app, 'GET /api/days If-None-Match (304)', not_modified, args.seconds)
+
+    version = app.get_db().execute("SELECT value FROM settings WHERE key = 'data_version'").fetchone()[0]
+    run(app, 'GET /api/days?since=<current> (no changes)',
+        lambda: make_environ(token, '/api/days', query=f'since={version}'), args.seconds)
+
+    page = lambda headers=None: lambda: make_environ(token, '/', headers=headers)
+    run(app, 'GET / (index.html)', page(), args.seconds)
+    run(app, 'GET / (index.html, gzip)', page({'HTTP_ACCEPT_ENCODING': 'gzip'}), args.seconds)
+    page_etag = app.get_static_file(os.path.join(app.STATIC_DIR, 'index.html')).etag
+    run(app, 'GET / If-None-Match (304)', page({'HTTP_IF_NONE_MATCH': page_etag}), args.seconds)
+
+    # after the first few, an IP's logins are turned away by its token bucket
+    login = json.dumps({'password': 'wrong'}).encode()
+    for _ in range(app.LOGIN_BURST):
+        request(app, make_environ('', '/api/login', 'POST', body=login, headers={'REMOTE_ADDR': '192.0.2.1'}))
+    run(app, 'POST /api/login (rate limited)',
+        lambda: make_environ('', '/api/login', 'POST', body=login, headers={'REMOTE_ADDR': '192.0.2.1'}), args.seconds)
+
+    # alternate between writes that upsert and writes that delete
+    for n in (1, 30, 365):
+        run(app, f'POST /api/days ({n} dates)',
+            writes(token, '/api/days', n, [{'status': 'school'}, {'status': 'free'}]), args.seconds)
+        run(app, f'POST /api/comment ({n} dates)',
+            writes(token, '/api/comment', n, [{'comment': 'booked'}, {'comment': ''}]), args.seconds)
+
+
+if __name__ == '__main__':
+    main()
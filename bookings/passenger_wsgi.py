@@ -7,6 +7,8 @@ plain `application(environ, start_response)` callable, or locally via
 server.py for development.
 """
 
+import email.utils
+import gzip
 import hashlib
 import hmac
 import json
@@ -15,11 +17,15 @@ import os
 import re
 import secrets
 import sqlite3
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
 
 STATIC_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(STATIC_DIR, 'bookings.db')
+DB_PATH = os.environ.get('BOOKINGS_DB') or os.path.join(STATIC_DIR, 'bookings.db')
 VALID_STATUSES = {'school', 'public', 'available'}
 DATE_RE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
 
@@ -28,49 +34,198 @@ SESSION_LIFETIME = 7 * 24 * 3600  # 7 days
 MAX_LOGIN_ATTEMPTS = 5
 LOCKOUT_SECONDS = 15 * 60
 PBKDF2_ITERATIONS = 260000
+PASSWORD_WORKERS = 2  # password checks hashing at once, per process
+PASSWORD_QUEUE = 8  # checks waiting for a worker before more are turned away
+LOGIN_BURST = 5  # login attempts an IP can make at once...
+LOGIN_RATE = 1 / 12  # ...and per second after that
+LOGIN_BUCKETS = 10000  # IPs remembered for that; the longest idle are forgotten first
+MAX_BODY_BYTES = 64 * 1024
+MAX_DATES = 1000  # per request; a few years' worth
+CHANGE_LOG_VERSIONS = 1000  # versions kept in the change log for /api/days?since=
+SESSION_CACHE_SIZE = 1024  # validated session tokens remembered per process
+SESSION_CACHE_SECONDS = 60  # how long one is trusted before checking the table again
+CLEANUP_INTERVAL = 15 * 60  # seconds between sweeps of expired sessions and login attempts
 
 _STATUS_LINES = {
     200: '200 OK',
     302: '302 Found',
+    304: '304 Not Modified',
     400: '400 Bad Request',
     401: '401 Unauthorized',
     404: '404 Not Found',
+    413: '413 Payload Too Large',
     429: '429 Too Many Requests',
     500: '500 Internal Server Error',
 }
 
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute('''
+SCHEMA = [
+    '''
         CREATE TABLE IF NOT EXISTS designations (
             date TEXT PRIMARY KEY,
             status TEXT NOT NULL DEFAULT 'free',
             comment TEXT
         )
-    ''')
-    conn.execute('''
+    ''',
+    '''
         CREATE TABLE IF NOT EXISTS settings (
             key TEXT PRIMARY KEY,
             value TEXT
         )
-    ''')
-    conn.execute('''
+    ''',
+    '''
         CREATE TABLE IF NOT EXISTS sessions (
             token TEXT PRIMARY KEY,
             expires_at INTEGER NOT NULL
         )
-    ''')
-    conn.execute('''
+    ''',
+    '''
         CREATE TABLE IF NOT EXISTS login_attempts (
             ip TEXT PRIMARY KEY,
             count INTEGER NOT NULL,
             locked_until INTEGER NOT NULL DEFAULT 0
         )
-    ''')
+    ''',
+]
+
+def add_column(table, column, definition):
+    """A migration step adding a column unless it is already there (SQLite has
+    no ADD COLUMN IF NOT EXISTS), e.g. left by an upgrade that didn't finish
+    before init_db made them atomic."""
+    def step(conn):
+        if column not in [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+    return step
+
+
+# Schema changes after the initial SCHEMA. Migration i takes the database from
+# PRAGMA user_version i to i + 1; append new ones, never edit old ones. Steps
+# are SQL statements or callables taking the connection.
+MIGRATIONS = [
+    # data_version is bumped by every write to designations and is the ETag of
+    # /api/days; data_epoch tells versions apart if the database is recreated
+    [
+        "INSERT OR IGNORE INTO settings (key, value) VALUES ('data_version', '0')",
+        "INSERT OR IGNORE INTO settings (key, value) VALUES ('data_epoch', lower(hex(randomblob(4))))",
+    ],
+    # the version each date last changed at, for /api/days?since=; changes at or
+    # below changes_floor have been compacted away (or predate the log, hence
+    # the bump so that since=0 always gets a full resync)
+    [
+        '''
+            CREATE TABLE IF NOT EXISTS changes (
+                date TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            )
+        ''',
+        'CREATE INDEX IF NOT EXISTS changes_version ON changes (version)',
+        "UPDATE settings SET value = CAST(value AS INTEGER) + 1 WHERE key = 'data_version'",
+        "INSERT OR IGNORE INTO settings (key, value) "
+        "SELECT 'changes_floor', value FROM settings WHERE key = 'data_version'",
+    ],
+    # when an IP last failed to log in, so that its count can expire
+    [
+        add_column('login_attempts', 'updated_at', 'INTEGER NOT NULL DEFAULT 0'),
+    ],
+]
+
+PRAGMAS = [
+    'PRAGMA synchronous = NORMAL',  # safe with WAL, avoids an fsync per commit
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -8000',  # 8 MB
+]
+
+_local = threading.local()
+
+
+def connect(path=None):
+    conn = sqlite3.connect(path or DB_PATH)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    # scratch list of the dates a request writes to, for set-based statements
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS batch_dates (date TEXT PRIMARY KEY)')
+    return conn
+
+
+def init_db(path=None):
+    """Create the schema and apply pending migrations. Every worker process
+    runs this when it imports the module, possibly several at once, so the
+    whole upgrade is one IMMEDIATE transaction: starters take turns, each
+    re-reads user_version once it holds the lock, and a crash part way
+    through rolls back to the previous version."""
+    conn = connect(path)
+    try:
+        conn.execute('PRAGMA journal_mode = WAL')  # persistent; lets readers run alongside a writer
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for statement in SCHEMA:
+                conn.execute(statement)
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            for migration in MIGRATIONS[version:]:
+                for step in migration:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(step)
+            if version < len(MIGRATIONS):
+                conn.execute(f'PRAGMA user_version = {len(MIGRATIONS)}')
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    finally:
+        conn.close()
+
+
+def get_db():
+    """The calling thread's persistent connection."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _local.conn = connect()
     return conn
 
 
+def bump_data_version(conn):
+    conn.execute("UPDATE settings SET value = CAST(value AS INTEGER) + 1 WHERE key = 'data_version'")
+    return int(conn.execute("SELECT value FROM settings WHERE key = 'data_version'").fetchone()[0])
+
+
+def log_changes(conn, dates):
+    """Bump the data version and record it against the changed dates, in the
+    caller's transaction. Entries older than CHANGE_LOG_VERSIONS are dropped."""
+    version = bump_data_version(conn)
+    conn.executemany(
+        'INSERT INTO changes (date, version) VALUES (?, ?) '
+        'ON CONFLICT(date) DO UPDATE SET version = excluded.version',
+        [(d, version) for d in dates],
+    )
+    floor = version - CHANGE_LOG_VERSIONS
+    if floor > 0 and version % 100 == 0:  # compact now and then, not on every write
+        conn.execute('DELETE FROM changes WHERE version <= ?', (floor,))
+        conn.execute("UPDATE settings SET value = ? WHERE key = 'changes_floor'", (str(floor),))
+    return version
+
+
+# callables(version, dates) run after a write to designations commits, e.g. by
+# asgi.py to push changes to /api/events clients
+_change_listeners = []
+
+
+def add_change_listener(listener):
+    _change_listeners.append(listener)
+
+
+def notify_changes(version, dates):
+    for listener in _change_listeners:
+        listener(version, dates)
+
+
+def get_data_etag(conn):
+    rows = dict(conn.execute("SELECT key, value FROM settings WHERE key IN ('data_version', 'data_epoch')"))
+    return f'"{rows.get("data_epoch", "")}-{rows.get("data_version", 0)}"'
+
+
 # ---- password hashing ----
 
 def hash_password(password):
@@ -89,6 +244,35 @@ def verify_password(password, stored):
     return hmac.compare_digest(digest.hex(), hash_hex)
 
 
+class PasswordCheckBusy(Exception):
+    pass
+
+
+_password_pool = None
+_password_pool_pid = None
+_password_pool_lock = threading.Lock()
+_password_slots = threading.BoundedSemaphore(PASSWORD_WORKERS + PASSWORD_QUEUE)
+
+
+def check_password(password, stored):
+    """verify_password on the password pool, at most PASSWORD_WORKERS at a
+    time so that logins can't take every CPU from calendar requests (hashlib
+    releases the GIL while hashing). Raises PasswordCheckBusy if
+    PASSWORD_QUEUE checks are already waiting."""
+    global _password_pool, _password_pool_pid
+    if not _password_slots.acquire(blocking=False):
+        raise PasswordCheckBusy()
+    try:
+        if _password_pool_pid != os.getpid():  # threads don't survive a fork (e.g. gunicorn --preload)
+            with _password_pool_lock:
+                if _password_pool_pid != os.getpid():
+                    _password_pool = ThreadPoolExecutor(PASSWORD_WORKERS, thread_name_prefix='bookings-password')
+                    _password_pool_pid = os.getpid()
+        return _password_pool.submit(verify_password, password, stored).result()
+    finally:
+        _password_slots.release()
+
+
 # ---- session / auth helpers ----
 
 def get_cookie_token(environ):
@@ -101,19 +285,65 @@ def get_cookie_token(environ):
     return morsel.value if morsel else None
 
 
+# token -> (expires_at, checked_at) of sessions found in the table, least
+# recently used first. Logout removes its token here as well as from the table;
+# other processes notice within SESSION_CACHE_SECONDS.
+_session_cache = OrderedDict()
+_session_lock = threading.Lock()
+_session_generation = 0  # bumped by every invalidation
+
+
+def _cached_session(token, now):
+    with _session_lock:
+        entry = _session_cache.get(token)
+        if entry is None:
+            return None
+        expires_at, checked_at = entry
+        if expires_at < now or checked_at + SESSION_CACHE_SECONDS < now:
+            del _session_cache[token]
+            return None
+        _session_cache.move_to_end(token)
+        return expires_at
+
+
+def _cache_session(token, expires_at, now, generation):
+    with _session_lock:
+        # a logout since the lookup began may have removed this token from the
+        # table after it was read; don't bring it back
+        if generation != _session_generation:
+            return
+        _session_cache[token] = (expires_at, now)
+        _session_cache.move_to_end(token)
+        while len(_session_cache) > SESSION_CACHE_SIZE:
+            _session_cache.popitem(last=False)
+
+
+def invalidate_session(token):
+    global _session_generation
+    with _session_lock:
+        _session_generation += 1
+        _session_cache.pop(token, None)
+
+
 def is_authenticated(conn, environ):
     token = get_cookie_token(environ)
     if not token:
         return False
+    now = int(time.time())
+    if _cached_session(token, now) is not None:
+        return True
+    generation = _session_generation
     row = conn.execute('SELECT expires_at FROM sessions WHERE token = ?', (token,)).fetchone()
-    return bool(row) and row[0] >= int(time.time())
+    if not row or row[0] < now:
+        return False
+    _cache_session(token, row[0], now, generation)
+    return True
 
 
 def create_session(conn):
     token = secrets.token_urlsafe(32)
     expires_at = int(time.time()) + SESSION_LIFETIME
     conn.execute('INSERT INTO sessions (token, expires_at) VALUES (?, ?)', (token, expires_at))
-    conn.execute('DELETE FROM sessions WHERE expires_at < ?', (int(time.time()),))
     return token, expires_at
 
 
@@ -142,6 +372,26 @@ def client_ip(environ):
     return environ.get('REMOTE_ADDR', 'unknown')
 
 
+# ip -> (tokens, updated_at), least recently used first
+_login_buckets = OrderedDict()
+_login_lock = threading.Lock()
+
+
+def take_login_token(ip):
+    """Take a token from the IP's bucket, which holds LOGIN_BURST and refills
+    at LOGIN_RATE per second. Returns 0 if there was one, otherwise the seconds
+    until there will be. In memory, so floods are turned away before SQLite."""
+    now = time.monotonic()
+    with _login_lock:
+        tokens, updated_at = _login_buckets.pop(ip, (LOGIN_BURST, now))
+        tokens = min(LOGIN_BURST, tokens + (now - updated_at) * LOGIN_RATE)
+        wait = 0 if tokens >= 1 else int((1 - tokens) / LOGIN_RATE) + 1
+        _login_buckets[ip] = (tokens - 1 if tokens >= 1 else tokens, now)
+        while len(_login_buckets) > LOGIN_BUCKETS:
+            _login_buckets.popitem(last=False)
+    return wait
+
+
 def check_lockout(conn, ip):
     now = int(time.time())
     row = conn.execute('SELECT locked_until FROM login_attempts WHERE ip = ?', (ip,)).fetchone()
@@ -156,9 +406,10 @@ def record_failed_attempt(conn, ip):
     count = (row[0] if row else 0) + 1
     locked_until = now + LOCKOUT_SECONDS if count >= MAX_LOGIN_ATTEMPTS else 0
     conn.execute(
-        'INSERT INTO login_attempts (ip, count, locked_until) VALUES (?, ?, ?) '
-        'ON CONFLICT(ip) DO UPDATE SET count = excluded.count, locked_until = excluded.locked_until',
-        (ip, count, locked_until),
+        'INSERT INTO login_attempts (ip, count, locked_until, updated_at) VALUES (?, ?, ?, ?) '
+        'ON CONFLICT(ip) DO UPDATE SET count = excluded.count, locked_until = excluded.locked_until, '
+        'updated_at = excluded.updated_at',
+        (ip, count, locked_until, now),
     )
 
 
@@ -166,6 +417,45 @@ def clear_attempts(conn, ip):
     conn.execute('DELETE FROM login_attempts WHERE ip = ?', (ip,))
 
 
+# ---- periodic cleanup ----
+
+_cleanup_lock = threading.Lock()
+_cleanup_pid = None  # process the cleanup thread runs in, in case a server forks after import
+
+
+def cleanup_expired(conn):
+    """Delete expired sessions, and failed login counts that are neither locked
+    out nor added to within the last LOCKOUT_SECONDS."""
+    now = int(time.time())
+    with conn:
+        conn.execute('DELETE FROM sessions WHERE expires_at < ?', (now,))
+        conn.execute('DELETE FROM login_attempts WHERE locked_until < ? AND updated_at < ?',
+                     (now, now - LOCKOUT_SECONDS))
+
+
+def _cleanup_loop():
+    conn = connect()
+    while True:
+        try:
+            cleanup_expired(conn)
+        except sqlite3.Error:
+            pass  # locked or busy; try again next time
+        time.sleep(CLEANUP_INTERVAL)
+
+
+def start_cleanup():
+    """Start this process's cleanup thread if it isn't running yet. Called by
+    requests rather than at import, so each worker gets one whether it imported
+    the module itself (as under Passenger) or was forked from a parent that did."""
+    global _cleanup_pid
+    if _cleanup_pid == os.getpid():
+        return
+    with _cleanup_lock:
+        if _cleanup_pid != os.getpid():
+            threading.Thread(target=_cleanup_loop, name='bookings-cleanup', daemon=True).start()
+            _cleanup_pid = os.getpid()
+
+
 # ---- response helpers ----
 
 def _status_line(code):
@@ -181,15 +471,19 @@ def json_response(start_response, obj, status=200, headers=None):
     return [body]
 
 
-def file_response(start_response, path, headers=None):
-    with open(path, 'rb') as f:
-        body = f.read()
-    content_type, _ = mimetypes.guess_type(path)
-    hdrs = [('Content-Type', content_type or 'application/octet-stream'), ('Content-Length', str(len(body)))]
-    if headers:
-        hdrs.extend(headers)
-    start_response(_status_line(200), hdrs)
-    return [body]
+def not_modified_response(start_response, etag, headers=None):
+    hdrs = [('ETag', etag)]
+    hdrs.extend(headers or [('Cache-Control', 'no-cache')])
+    start_response(_status_line(304), hdrs)
+    return [b'']
+
+
+def etag_matches(environ, etag):
+    header = environ.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    tags = [t.strip() for t in header.split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
 
 
 def redirect_response(start_response, location):
@@ -197,11 +491,94 @@ def redirect_response(start_response, location):
     return [b'']
 
 
-def serve_static(start_response, filename, headers=None):
-    path = os.path.join(STATIC_DIR, filename)
-    if not os.path.isfile(path):
+# ---- static files ----
+
+# path -> StaticFile, rebuilt whenever the file's mtime or size changes
+_static_cache = {}
+_static_lock = threading.Lock()
+
+
+class StaticFile:
+    """A file's contents as served: its type, validators, and a gzipped copy
+    if that is worth sending."""
+
+    def __init__(self, path, stat):
+        with open(path, 'rb') as f:
+            self.body = f.read()
+        self.key = (stat.st_mtime_ns, stat.st_size)
+        content_type, _ = mimetypes.guess_type(path)
+        self.content_type = content_type or 'application/octet-stream'
+        self.etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        self.last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+        self.gzip_body = None
+        if self.content_type.startswith('text/') or self.content_type in ('application/javascript', 'application/json'):
+            compressed = gzip.compress(self.body, 9, mtime=0)
+            if len(compressed) < len(self.body):
+                self.gzip_body = compressed
+
+
+def get_static_file(path):
+    """The cached StaticFile for path, reloaded if it changed on disk; None if
+    there is no such file."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    entry = _static_cache.get(path)
+    if entry is None or entry.key != (stat.st_mtime_ns, stat.st_size):
+        with _static_lock:
+            entry = _static_cache[path] = StaticFile(path, stat)
+    return entry
+
+
+def accepts_gzip(environ):
+    """Whether Accept-Encoding allows gzip, by name or as *, with q above 0."""
+    weights = {}
+    for coding in environ.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, _, params = coding.partition(';')
+        params = params.replace(' ', '')
+        try:
+            weights[name.strip().lower()] = float(params[2:]) if params.startswith('q=') else 1.0
+        except ValueError:
+            weights[name.strip().lower()] = 0.0
+    return weights.get('gzip', weights.get('*', 0.0)) > 0
+
+
+def not_modified_since(environ, last_modified):
+    header = environ.get('HTTP_IF_MODIFIED_SINCE')
+    if not header or environ.get('HTTP_IF_NONE_MATCH'):
+        return False
+    try:
+        return email.utils.parsedate_to_datetime(header) >= email.utils.parsedate_to_datetime(last_modified)
+    except (TypeError, ValueError):
+        return False
+
+
+def serve_static(environ, start_response, filename, cache_control='no-cache'):
+    """Serve a file from STATIC_DIR out of memory, gzipped if the client takes
+    it, answering conditional requests with 304. The default Cache-Control has
+    browsers revalidate on every load, so edits show up straight away."""
+    entry = get_static_file(os.path.join(STATIC_DIR, filename))
+    if entry is None:
         return json_response(start_response, {'error': 'not found'}, 404)
-    return file_response(start_response, path, headers=headers)
+    gzipped = entry.gzip_body is not None and accepts_gzip(environ)
+    # the two encodings are different representations, so need different tags
+    etag = entry.etag[:-1] + '-gzip"' if gzipped else entry.etag
+    hdrs = [('Last-Modified', entry.last_modified), ('Cache-Control', cache_control)]
+    if entry.gzip_body is not None:
+        hdrs.append(('Vary', 'Accept-Encoding'))
+    if etag_matches(environ, etag) or not_modified_since(environ, entry.last_modified):
+        return not_modified_response(start_response, etag, hdrs)
+    body = entry.gzip_body if gzipped else entry.body
+    hdrs[:0] = [('Content-Type', entry.content_type), ('Content-Length', str(len(body))), ('ETag', etag)]
+    if gzipped:
+        hdrs.append(('Content-Encoding', 'gzip'))
+    start_response(_status_line(200), hdrs)
+    return [body]
+
+
+class PayloadTooLarge(ValueError):
+    pass
 
 
 def read_json_body(environ):
@@ -209,27 +586,37 @@ def read_json_body(environ):
         length = int(environ.get('CONTENT_LENGTH', 0) or 0)
     except ValueError:
         length = 0
+    if length > MAX_BODY_BYTES:
+        raise PayloadTooLarge(f'request body over {MAX_BODY_BYTES} bytes')
     raw = environ['wsgi.input'].read(length) if length else b''
     return json.loads(raw or b'{}')
 
 
 def valid_dates(dates):
-    return isinstance(dates, list) and dates and all(
+    return isinstance(dates, list) and dates and len(dates) <= MAX_DATES and all(
         isinstance(d, str) and DATE_RE.match(d) for d in dates
     )
 
 
+def load_batch_dates(conn, dates):
+    conn.execute('DELETE FROM batch_dates')
+    conn.executemany('INSERT OR IGNORE INTO batch_dates (date) VALUES (?)', [(d,) for d in dates])
+
+
 # ---- route handlers ----
 
 def handle_login(environ, start_response, conn):
     ip = client_ip(environ)
-    remaining = check_lockout(conn, ip)
+    remaining = take_login_token(ip) or check_lockout(conn, ip)
     if remaining > 0:
-        return json_response(start_response, {'error': f'Too many attempts. Try again in {remaining}s.'}, 429)
+        return json_response(start_response, {'error': f'Too many attempts. Try again in {remaining}s.'}, 429,
+                             headers=[('Retry-After', str(remaining))])
 
     try:
         payload = read_json_body(environ)
         password = payload['password']
+    except PayloadTooLarge as e:
+        return json_response(start_response, {'error': str(e)}, 413)
     except (KeyError, ValueError, TypeError):
         return json_response(start_response, {'error': 'invalid payload'}, 400)
 
@@ -237,7 +624,12 @@ def handle_login(environ, start_response, conn):
     if not row:
         return json_response(start_response, {'error': 'no password has been set on the server'}, 500)
 
-    if not isinstance(password, str) or not verify_password(password, row[0]):
+    try:
+        ok = isinstance(password, str) and check_password(password, row[0])
+    except PasswordCheckBusy:
+        return json_response(start_response, {'error': 'Too many logins at once. Try again shortly.'}, 429,
+                             headers=[('Retry-After', '1')])
+    if not ok:
         record_failed_attempt(conn, ip)
         conn.commit()
         return json_response(start_response, {'error': 'incorrect password'}, 401)
@@ -254,15 +646,77 @@ def handle_logout(environ, start_response, conn):
     if token:
         conn.execute('DELETE FROM sessions WHERE token = ?', (token,))
         conn.commit()
+        # after the commit, so no other thread can read the row back into the cache
+        invalidate_session(token)
     return json_response(start_response, {'ok': True}, 200, headers=[('Set-Cookie', clear_cookie_header(environ))])
 
 
-def handle_get_days(start_response, conn):
-    rows = conn.execute('SELECT date, status, comment FROM designations').fetchall()
+def get_range_etag(conn, date_from, date_to):
+    """Validator for the days in [date_from, date_to]: the last version that
+    changed one of them (or the change log floor if that has been compacted
+    away), so writes to other dates don't invalidate it."""
+    settings = dict(conn.execute("SELECT key, value FROM settings WHERE key IN ('data_epoch', 'changes_floor')"))
+    last = conn.execute('SELECT MAX(version) FROM changes WHERE date BETWEEN ? AND ?', (date_from, date_to)).fetchone()[0]
+    return f'"{settings.get("data_epoch", "")}-r{max(int(settings.get("changes_floor", 0)), last or 0)}"'
+
+
+def handle_get_days(environ, start_response, conn, date_from=None, date_to=None):
+    # read the version before the table: if a write lands in between, the body
+    # is newer than its ETag and the next poll fetches it again, never older
+    if date_from is None:
+        etag = get_data_etag(conn)
+    else:
+        etag = get_range_etag(conn, date_from, date_to)
+    if etag_matches(environ, etag):
+        return not_modified_response(start_response, etag)
+    if date_from is None:
+        rows = conn.execute('SELECT date, status, comment FROM designations').fetchall()
+    else:
+        rows = conn.execute('SELECT date, status, comment FROM designations WHERE date BETWEEN ? AND ?',
+                            (date_from, date_to)).fetchall()
     return json_response(start_response, {
         date: {'status': status, 'comment': comment}
         for date, status, comment in rows
-    })
+    }, headers=[('ETag', etag), ('Cache-Control', 'no-cache')])
+
+
+def handle_get_changes(environ, start_response, conn, since, epoch, date_from=None, date_to=None):
+    """Dates changed after version `since`, with None for dates that are now
+    free and uncommented. Falls back to every date (full=True) when the log no
+    longer reaches back that far or the database has been recreated. Both are
+    limited to [date_from, date_to] if given."""
+    date_from, date_to = date_from or '0000-00-00', date_to or '9999-99-99'
+    settings = dict(conn.execute(
+        "SELECT key, value FROM settings WHERE key IN ('data_version', 'data_epoch', 'changes_floor')"))
+    version = int(settings.get('data_version', 0))
+    current_epoch = settings.get('data_epoch', '')
+    full = since < int(settings.get('changes_floor', 0)) or since > version or \
+        (epoch is not None and epoch != current_epoch)
+    if full:
+        rows = conn.execute('SELECT date, status, comment FROM designations WHERE date BETWEEN ? AND ?',
+                            (date_from, date_to))
+        days = {date: {'status': status, 'comment': comment} for date, status, comment in rows}
+    else:
+        rows = conn.execute(
+            'SELECT c.date, d.status, d.comment FROM changes c LEFT JOIN designations d ON d.date = c.date '
+            'WHERE c.version > ? AND c.date BETWEEN ? AND ?', (since, date_from, date_to))
+        days = {
+            date: None if status is None else {'status': status, 'comment': comment}
+            for date, status, comment in rows
+        }
+    return json_response(start_response, {'version': version, 'epoch': current_epoch, 'full': full, 'days': days},
+                         headers=[('Cache-Control', 'no-cache')])
+
+
+def parse_date_range(query):
+    """The (from, to) dates of a query string, (None, None) if absent. Raises
+    ValueError if only one is given or either is not YYYY-MM-DD."""
+    date_from, date_to = query.get('from', [None])[0], query.get('to', [None])[0]
+    if date_from is None and date_to is None:
+        return None, None
+    if not (date_from and date_to and DATE_RE.match(date_from) and DATE_RE.match(date_to)):
+        raise ValueError('from and to must both be YYYY-MM-DD dates')
+    return date_from, date_to
 
 
 def handle_set_status(environ, start_response, conn):
@@ -270,28 +724,32 @@ def handle_set_status(environ, start_response, conn):
         payload = read_json_body(environ)
         dates = payload['dates']
         status = payload['status']
+    except PayloadTooLarge as e:
+        return json_response(start_response, {'error': str(e)}, 413)
     except (KeyError, ValueError, TypeError):
         return json_response(start_response, {'error': 'invalid payload'}, 400)
 
     if not valid_dates(dates):
-        return json_response(start_response, {'error': 'dates must be a non-empty list of YYYY-MM-DD strings'}, 400)
+        return json_response(start_response, {
+            'error': f'dates must be a non-empty list of at most {MAX_DATES} YYYY-MM-DD strings'}, 400)
     if status != 'free' and status not in VALID_STATUSES:
         return json_response(start_response, {'error': 'invalid status'}, 400)
 
-    for d in dates:
-        if status == 'free':
-            row = conn.execute('SELECT comment FROM designations WHERE date = ?', (d,)).fetchone()
-            if row and row[0]:
-                conn.execute('UPDATE designations SET status = ? WHERE date = ?', ('free', d))
-            else:
-                conn.execute('DELETE FROM designations WHERE date = ?', (d,))
-        else:
-            conn.execute(
-                'INSERT INTO designations (date, status) VALUES (?, ?) '
-                'ON CONFLICT(date) DO UPDATE SET status = excluded.status',
-                (d, status),
-            )
+    if status == 'free':
+        # days with a comment keep their row, the rest go
+        load_batch_dates(conn, dates)
+        conn.execute("DELETE FROM designations WHERE date IN (SELECT date FROM batch_dates) "
+                     "AND (comment IS NULL OR comment = '')")
+        conn.execute("UPDATE designations SET status = 'free' WHERE date IN (SELECT date FROM batch_dates)")
+    else:
+        conn.executemany(
+            'INSERT INTO designations (date, status) VALUES (?, ?) '
+            'ON CONFLICT(date) DO UPDATE SET status = excluded.status',
+            [(d, status) for d in dates],
+        )
+    version = log_changes(conn, dates)
     conn.commit()
+    notify_changes(version, dates)
     return json_response(start_response, {'ok': True})
 
 
@@ -300,6 +758,8 @@ def handle_set_comment(environ, start_response, conn):
         payload = read_json_body(environ)
         dates = payload['dates']
         comment = payload.get('comment', '')
+    except PayloadTooLarge as e:
+        return json_response(start_response, {'error': str(e)}, 413)
     except (KeyError, ValueError, TypeError):
         return json_response(start_response, {'error': 'invalid payload'}, 400)
 
@@ -308,18 +768,20 @@ def handle_set_comment(environ, start_response, conn):
 
     comment = comment.strip() or None
 
-    for d in dates:
-        row = conn.execute('SELECT status FROM designations WHERE date = ?', (d,)).fetchone()
-        status = row[0] if row else 'free'
-        if comment is None and status == 'free':
-            conn.execute('DELETE FROM designations WHERE date = ?', (d,))
-        else:
-            conn.execute(
-                'INSERT INTO designations (date, status, comment) VALUES (?, ?, ?) '
-                'ON CONFLICT(date) DO UPDATE SET comment = excluded.comment',
-                (d, status, comment),
-            )
+    if comment is None:
+        # free days without a comment have nothing left to store
+        load_batch_dates(conn, dates)
+        conn.execute("DELETE FROM designations WHERE date IN (SELECT date FROM batch_dates) AND status = 'free'")
+        conn.execute('UPDATE designations SET comment = NULL WHERE date IN (SELECT date FROM batch_dates)')
+    else:
+        conn.executemany(
+            "INSERT INTO designations (date, status, comment) VALUES (?, 'free', ?) "
+            'ON CONFLICT(date) DO UPDATE SET comment = excluded.comment',
+            [(d, comment) for d in dates],
+        )
+    version = log_changes(conn, dates)
     conn.commit()
+    notify_changes(version, dates)
     return json_response(start_response, {'ok': True})
 
 
@@ -327,10 +789,11 @@ def application(environ, start_response):
     path = environ.get('PATH_INFO') or '/'
     method = environ.get('REQUEST_METHOD', 'GET')
 
+    start_cleanup()
     conn = get_db()
     try:
         if path == '/login.html' and method == 'GET':
-            return serve_static(start_response, 'login.html')
+            return serve_static(environ, start_response, 'login.html')
 
         if path == '/api/login' and method == 'POST':
             return handle_login(environ, start_response, conn)
@@ -343,12 +806,24 @@ def application(environ, start_response):
         if path in ('/', '/index.html') and method == 'GET':
             if not authed:
                 return redirect_response(start_response, '/login.html')
-            return serve_static(start_response, 'index.html')
+            return serve_static(environ, start_response, 'index.html', 'private, no-cache')
 
         if path == '/api/days' and method == 'GET':
             if not authed:
                 return json_response(start_response, {'error': 'unauthorized'}, 401)
-            return handle_get_days(start_response, conn)
+            query = parse_qs(environ.get('QUERY_STRING', ''))
+            try:
+                date_from, date_to = parse_date_range(query)
+            except ValueError as e:
+                return json_response(start_response, {'error': str(e)}, 400)
+            if 'since' in query:
+                try:
+                    since = int(query['since'][0])
+                except ValueError:
+                    return json_response(start_response, {'error': 'since must be an integer version'}, 400)
+                return handle_get_changes(environ, start_response, conn, since, query.get('epoch', [None])[0],
+                                          date_from, date_to)
+            return handle_get_days(environ, start_response, conn, date_from, date_to)
 
         if path == '/api/days' and method == 'POST':
             if not authed:
@@ -362,4 +837,9 @@ def application(environ, start_response):
 
         return json_response(start_response, {'error': 'not found'}, 404)
     finally:
-        conn.close()
+        # the connection outlives the request, so never leave a transaction open on it
+        if conn.in_transaction:
+            conn.rollback()
+
+
+init_db()
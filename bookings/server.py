@@ -4,19 +4,90 @@
 Production deployment (e.g. GoDaddy cPanel's "Setup Python App") runs
 passenger_wsgi.py directly under Passenger. This script runs the exact
 same WSGI app with Python's built-in dev server, for local testing.
+
+With --asgi it runs asgi.py instead, which adds the /api/events stream, on
+a minimal asyncio HTTP server (one request per connection) so that no ASGI
+server needs installing.
 """
 
+import argparse
+import asyncio
 import os
+from http import HTTPStatus
+from urllib.parse import unquote
 from wsgiref.simple_server import make_server
 
-from passenger_wsgi import application
+
+async def serve_asgi(application, host, port):
+    async def handle(reader, writer):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+            request_line, *header_lines = head.decode('latin-1').rstrip('\r\n').split('\r\n')
+            method, target, _ = request_line.split(' ', 2)
+            headers = []
+            for line in header_lines:
+                name, _, value = line.partition(':')
+                headers.append((name.strip().lower().encode('latin-1'), value.strip().encode('latin-1')))
+            length = int(dict(headers).get(b'content-length', 0))
+            body = await reader.readexactly(length) if length else b''
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            writer.close()
+            return
+
+        path, _, query = target.partition('?')
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'scheme': 'http',
+            'method': method, 'path': unquote(path), 'raw_path': path.encode('latin-1'),
+            'query_string': query.encode('latin-1'), 'root_path': '', 'headers': headers,
+            'client': writer.get_extra_info('peername')[:2], 'server': (host, port),
+        }
+        requested = False
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            await reader.read()  # nothing more is sent until the client hangs up
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                writer.write(f'HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n'.encode('latin-1'))
+                for name, value in message.get('headers', []):
+                    writer.write(name + b': ' + value + b'\r\n')
+                writer.write(b'Connection: close\r\n\r\n')
+            elif message['type'] == 'http.response.body':
+                writer.write(message.get('body', b''))
+                await writer.drain()
+
+        try:
+            await application(scope, receive, send)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    async with server:
+        await server.serve_forever()
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Run the booking calendar locally.')
+    parser.add_argument('--asgi', action='store_true', help='serve asgi.py, with /api/events, instead of the WSGI app')
+    args = parser.parse_args()
+
     port = int(os.environ.get('PORT', 8080))
     print(f'Booking calendar server running at http://localhost:{port}')
     try:
-        make_server('0.0.0.0', port, application).serve_forever()
+        if args.asgi:
+            from asgi import application
+            asyncio.run(serve_asgi(application, '0.0.0.0', port))
+        else:
+            from passenger_wsgi import application
+            make_server('0.0.0.0', port, application).serve_forever()
     except KeyboardInterrupt:
         pass
 
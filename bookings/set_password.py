@@ -10,7 +10,7 @@ production server, or locally for development:
 import getpass
 import sys
 
-from passenger_wsgi import get_db, hash_password
+from passenger_wsgi import connect, hash_password
 
 
 def main():
@@ -23,7 +23,7 @@ def main():
         print('Password must be at least 8 characters.', file=sys.stderr)
         sys.exit(1)
 
-    conn = get_db()
+    conn = connect()
     conn.execute(
         'INSERT INTO settings (key, value) VALUES (?, ?) '
         'ON CONFLICT(key) DO UPDATE SET value = excluded.value',
@@ -109,6 +109,60 @@ class GameState:
     def __str__(self):
         return GameState.board2str(self.board)
 
+# ----------------------------------------------------------------------------
+#
+# Bit-packed boards. Bit i is set if hole i holds a red peg and bit 17 + i is set if hole i holds a black peg. Every
+# move fills the free hole so MOVES[free_peg] lists each candidate move as its source hole, the bits that must be set
+# for the move to be legal, and the bits to xor with the board to make (or unmake) the move.
+#
+
+def board2bits(board):
+    """Packs a board array into an integer."""
+    bits = 0
+    for i in range(17):
+        if board[i] == RED:
+            bits |= 1 << i
+        elif board[i] == BLACK:
+            bits |= 1 << (17 + i)
+    return bits
+
+
+def bits2board(bits):
+    """Unpacks an integer into a board array."""
+    board = np.zeros((17,), dtype=np.int8)
+    for i in range(17):
+        if bits & (1 << i):
+            board[i] = RED
+        elif bits & (1 << (17 + i)):
+            board[i] = BLACK
+    return board
+
+
+TARGET_BITS = board2bits(TARGET)
+
+def makeMoves(num_holes, edges, jumps):
+    """Builds the table of bit-packed moves into each free hole for a board with the given edges and jumps (with
+    black pegs stored in bits num_holes and up)."""
+    n = num_holes
+    moves = [() for i in range(n)]
+    for i in range(n):
+        moves[i] = tuple([(u, 1 << u, (1 << u) | (1 << i)) for u, v in edges if v == i] +
+                         [(v, 1 << (n + v), (1 << (n + v)) | (1 << (n + i))) for u, v in edges if u == i] +
+                         [(u, (1 << u) | (1 << (n + v)), (1 << u) | (1 << i)) for u, v, w in jumps if w == i] +
+                         [(w, (1 << v) | (1 << (n + w)), (1 << (n + w)) | (1 << (n + i))) for u, v, w in jumps if u == i])
+    return moves
+
+
+MOVES = makeMoves(17, EDGES, JUMPS)
+
+
+def replayMoves(moves):
+    """Returns the GameState reached by playing a sequence of (src, dst) moves from the initial state."""
+    state = GameState()
+    for src, dst in moves:
+        state = state.move(src, dst)
+    return state
+
 # ----------------------------------------------------------------------------
 
 def getLaTeXHeader():
@@ -212,32 +266,107 @@ def getBoardAsImage(board, move=None, dpi=80):
 
     # grab figure as an image
     f.canvas.draw()
-    img = np.frombuffer(f.canvas.tostring_rgb(), dtype=np.uint8)
-    img = img.reshape(f.canvas.get_width_height()[::-1] + (3,))
+    img = np.array(f.canvas.buffer_rgba())[:, :, :3]
     plt.close(f)
 
     return img
 
 
+class BoardRenderer:
+    """Renders boards as three channel images like getBoardAsImage. Peg, hole and arrow sprites are rasterised once
+    with numpy and each frame is composited into a reusable buffer, which is returned by render (and overwritten by
+    the next call)."""
+
+    PX = [0, 1, 1, 2, 2, 2, 3, 3, 4, 5, 5, 6, 6, 6, 7, 7, 8]
+    PY = [2, 3, 1, 4, 2, 0, 3, 1, 2, 3, 1, 4, 2, 0, 3, 1, 2]
+
+    def __init__(self, dpi=80):
+        self.dpi = dpi
+        self.pt = dpi / 72.0
+        self.background = np.full((6 * dpi, 10 * dpi, 3), 255, dtype=np.uint8)
+        self.buffer = self.background.copy()
+
+        self.radius = int(np.ceil(0.35 * dpi + self.pt))
+        self.sprites = {
+            RED: self.make_peg((1.0, 0.5, 0.5), (1.0, 0.5, 0.5)),
+            BLACK: self.make_peg((0.5, 0.5, 0.5), (0.5, 0.5, 0.5)),
+            EMPTY: self.make_peg((0.9, 0.9, 0.9), (0.5, 0.5, 0.5)),
+        }
+        self.arrows = {}
+
+    def centre(self, i):
+        """Returns the pixel coordinates of hole i."""
+        return (self.PX[i] + 1) * self.dpi, (5 - self.PY[i]) * self.dpi
+
+    def make_peg(self, fill, edge):
+        """Rasterises an anti-aliased circle with the given fill and edge colours on a white background."""
+        r = self.radius
+        y, x = np.mgrid[-r:r, -r:r] + 0.5
+        d = np.sqrt(x * x + y * y)
+        fill_alpha = np.clip(0.35 * self.dpi - d + 0.5, 0.0, 1.0)[:, :, np.newaxis]
+        edge_alpha = np.clip(0.5 * self.pt - np.abs(d - 0.35 * self.dpi) + 0.5, 0.0, 1.0)[:, :, np.newaxis]
+        img = 255.0 * (1.0 - fill_alpha) + 255.0 * np.array(fill) * fill_alpha
+        img = img * (1.0 - edge_alpha) + 255.0 * np.array(edge) * edge_alpha
+        return np.round(img).astype(np.uint8)
+
+    def make_arrow(self, src, dst):
+        """Rasterises the alpha mask of a curved arrow from hole src to hole dst (with the same arc3 connection,
+        2pt shrink and Simple arrow style as getBoardAsImage). Returns the mask and its top-left pixel."""
+
+        (x1, y1), (x2, y2) = self.centre(src), self.centre(dst)
+        cx, cy = 0.5 * (x1 + x2) - 0.5 * (y2 - y1), 0.5 * (y1 + y2) + 0.5 * (x2 - x1)
+
+        # sample the quadratic bezier densely and trim the ends
+        t = np.linspace(0.0, 1.0, 256)[:, np.newaxis]
+        pts = (1 - t) ** 2 * np.array([x1, y1]) + 2 * (1 - t) * t * np.array([cx, cy]) + t ** 2 * np.array([x2, y2])
+        s = np.concatenate(([0.0], np.cumsum(np.linalg.norm(np.diff(pts, axis=0), axis=1))))
+        keep = (s >= 2.0 * self.pt) & (s <= s[-1] - 2.0 * self.pt)
+        pts, s = pts[keep], s[keep] - s[keep][0]
+
+        # half width of the arrow along the curve (thin tail followed by a triangular head) plus half the 1pt edge
+        head_length, length = 8.0 * self.pt, s[-1]
+        width = np.where(s < length - head_length, 0.25 * self.pt, 2.0 * self.pt * (length - s) / head_length)
+        width += 0.5 * self.pt
+
+        x0, y0 = int(np.floor(pts[:, 0].min())) - 4, int(np.floor(pts[:, 1].min())) - 4
+        x3, y3 = int(np.ceil(pts[:, 0].max())) + 4, int(np.ceil(pts[:, 1].max())) + 4
+        y, x = np.mgrid[y0:y3, x0:x3] + 0.5
+        d = np.sqrt((x[:, :, np.newaxis] - pts[:, 0]) ** 2 + (y[:, :, np.newaxis] - pts[:, 1]) ** 2)
+        alpha = np.max(width + 0.5 - d, axis=2)
+        return np.clip(alpha, 0.0, 1.0)[:, :, np.newaxis], (x0, y0)
+
+    def render(self, board, move=None):
+        """Renders the board (with an optional (src, dst) move arrow) into the buffer and returns it."""
+
+        r = self.radius
+        self.buffer[...] = self.background
+        for i in range(17):
+            x, y = self.centre(i)
+            self.buffer[y - r:y + r, x - r:x + r] = self.sprites[board[i]]
+
+        if move is not None:
+            if move not in self.arrows:
+                self.arrows[move] = self.make_arrow(*move)
+            alpha, (x0, y0) = self.arrows[move]
+            region = self.buffer[y0:y0 + alpha.shape[0], x0:x0 + alpha.shape[1]]
+            region[...] = np.round(region * (1.0 - alpha))
+
+        return self.buffer
+
+
 # ----------------------------------------------------------------------------
 
-if __name__ == "__main__":
+def searchGameStates(state):
+    """Depth-first search for solutions starting from the given state. Every state on the frontier is a separate
+    GameState object. Returns the number of states explored, a dictionary of solution counts indexed by number of moves,
+    and a dictionary with the first solution found for each number of moves."""
 
-    # initialise search
-    frontier = [GameState()]
+    frontier = [state]
     numStatesExplored = 0
-    solutions = {}
     numSolutionsFound = 0
-    bestSolutionFound = None
-    bestSolutionMoves = np.inf
-
-    # force first three moves
-    if True:
-        frontier[0] = frontier[0].move(10, 8)
-        frontier[0] = frontier[0].move(6, 10)
-        frontier[0] = frontier[0].move(8, 6)
+    counts = {}
+    solutions = {}
 
-    # search for best solution
     while (len(frontier)):
         state = frontier.pop()
         numStatesExplored += 1
@@ -246,34 +375,13 @@ if __name__ == "__main__":
 
         if state.is_solved():
             numSolutionsFound += 1
-            if state.num_moves < bestSolutionMoves:
-                bestSolutionFound = state
-                bestSolutionMoves = state.num_moves
+            counts[state.num_moves] = counts.get(state.num_moves, 0) + 1
             if state.num_moves not in solutions:
                 solutions[state.num_moves] = state
                 print("\r...{} ({}, {})".format(numStatesExplored, numSolutionsFound, len(frontier)), end="")
                 print("\nsolution found with {} moves".format(state.num_moves))
-
-            #if state.num_moves == 46:
-            #    break
             continue
 
-        """
-        for u, v in EDGES:
-            if (state.board[u] == RED) and (state.board[v] == EMPTY):
-                frontier.append(state.move(u, v))
-
-            if (state.board[u] == EMPTY) and (state.board[v] == BLACK):
-                frontier.append(state.move(v, u))
-
-        for u, v, w in JUMPS:
-            if (state.board[u] == RED) and (state.board[v] == BLACK) and (state.board[w] == EMPTY):
-                frontier.append(state.move(u, w))
-
-            if (state.board[u] == EMPTY) and (state.board[v] == RED) and (state.board[w] == BLACK):
-                frontier.append(state.move(w, u))
-        """
-
         for u, v in EDGES_R[state.free_peg]:
             if (state.board[u] == RED):
                 frontier.append(state.move(u, v))
@@ -290,6 +398,322 @@ if __name__ == "__main__":
             if (state.board[v] == RED) and (state.board[w] == BLACK):
                 frontier.append(state.move(w, u))
 
+    return numStatesExplored, counts, solutions
+
+
+def searchBitPacked(state, verbose=True):
+    """Same search as searchGameStates but on bit-packed boards with make/unmake moves so that only the current path
+    is kept in memory. Explores states in the same order and returns the same results."""
+
+    prefix = state.history()[1][:-1]
+    board, free_peg = board2bits(state.board), state.free_peg
+
+    numStatesExplored = 0
+    numSolutionsFound = 0
+    numPending = 1
+    counts = {}
+    solutions = {}
+
+    # stack of untried moves at each depth and moves made along the current path, starting with a null move into the
+    # initial state
+    stack = [[(free_peg, 0)]]
+    path = []
+
+    while stack:
+        moves = stack[-1]
+        if not moves:
+            stack.pop()
+            if path:
+                src, dst, mask = path.pop()
+                board ^= mask
+                free_peg = dst
+            continue
+
+        src, mask = moves.pop()
+        board ^= mask
+        path.append((src, free_peg, mask))
+        free_peg = src
+
+        numPending -= 1
+        numStatesExplored += 1
+        if verbose and numStatesExplored % 5000 == 0:
+            print("\r...{} ({}, {})".format(numStatesExplored, numSolutionsFound, numPending), end="")
+
+        if board == TARGET_BITS:
+            numMoves = len(prefix) + len(path) - 1
+            numSolutionsFound += 1
+            counts[numMoves] = counts.get(numMoves, 0) + 1
+            if numMoves not in solutions:
+                solutions[numMoves] = replayMoves(prefix + [(s, d) for s, d, m in path[1:]])
+                if verbose:
+                    print("\r...{} ({}, {})".format(numStatesExplored, numSolutionsFound, numPending), end="")
+                    print("\nsolution found with {} moves".format(numMoves))
+            stack.append([])
+            continue
+
+        moves = [(src, mask) for src, cond, mask in MOVES[free_peg] if board & cond == cond]
+        numPending += len(moves)
+        stack.append(moves)
+
+    return numStatesExplored, counts, solutions
+
+
+def countSolutions(state):
+    """Counts solutions by number of moves without enumerating them. Each distinct (board, free_peg) state reachable
+    from the given state is expanded once and memoized with the number of paths to the target by number of remaining
+    moves, the number of states a depth-first search would explore below it, and the first move of an example path
+    for each number of remaining moves. Examples are taken from the child the depth-first search would explore first
+    so the solutions returned are the same as those found by searchGameStates and searchBitPacked. Returns the
+    number of states explored (by depth-first search), a dictionary of solution counts indexed by number of moves, a
+    dictionary with an example solution for each number of moves, and the number of distinct states reached."""
+
+    memo = {}
+
+    def expand(board, free_peg):
+        key = (board, free_peg)
+        if key in memo:
+            return memo[key]
+
+        if board == TARGET_BITS:
+            memo[key] = ({0: 1}, 1, {0: None})
+            return memo[key]
+
+        counts, numStates, examples = {}, 1, {}
+        moves = [(src, mask) for src, cond, mask in MOVES[free_peg] if board & cond == cond]
+        for src, mask in reversed(moves):
+            child_counts, child_states, child_examples = expand(board ^ mask, src)
+            numStates += child_states
+            for n, c in child_counts.items():
+                counts[n + 1] = counts.get(n + 1, 0) + c
+                if n + 1 not in examples:
+                    examples[n + 1] = (src, mask)
+
+        memo[key] = (counts, numStates, examples)
+        return memo[key]
+
+    prefix = state.history()[1][:-1]
+    board, free_peg = board2bits(state.board), state.free_peg
+    remaining, numStatesExplored, examples = expand(board, free_peg)
+
+    counts, solutions = {}, {}
+    for n in remaining.keys():
+        moves, b, f = list(prefix), board, free_peg
+        for k in range(n, 0, -1):
+            src, mask = memo[(b, f)][2][k]
+            moves.append((src, f))
+            b, f = b ^ mask, src
+        counts[len(prefix) + n] = remaining[n]
+        solutions[len(prefix) + n] = replayMoves(moves)
+
+    return numStatesExplored, counts, solutions, len(memo)
+
+
+def makeBoard(num_diamonds=2, size=3):
+    """Builds a board from the peg swap family: num_diamonds (even) diamonds of size-by-size holes joined corner to
+    corner in a row. Holes are numbered left to right (top to bottom within a column) so that makeBoard(2, 3) gives
+    the 17-hole board above. Returns the hole coordinates and the edges and jumps, each directed left to right."""
+
+    assert (num_diamonds % 2 == 0) and (size >= 2)
+    holes = set()
+    for d in range(num_diamonds):
+        for i in range(size):
+            for j in range(size):
+                holes.add((2 * (size - 1) * d + i + j, size - 1 + i - j))
+    holes = sorted(holes, key=lambda h: (h[0], -h[1]))
+    index = {h: k for k, h in enumerate(holes)}
+
+    edges, jumps = [], []
+    for (x, y) in holes:
+        for dy in (1, -1):
+            if (x + 1, y + dy) in index:
+                edges.append((index[(x, y)], index[(x + 1, y + dy)]))
+                if (x + 2, y + 2 * dy) in index:
+                    jumps.append((index[(x, y)], index[(x + 1, y + dy)], index[(x + 2, y + 2 * dy)]))
+
+    px, py = [h[0] for h in holes], [h[1] for h in holes]
+    return px, py, tuple(sorted(edges)), tuple(sorted(jumps))
+
+
+def countBoardSolutions(num_holes, edges, jumps, max_states=None):
+    """Counts solutions by number of moves for a board from the peg swap family with red pegs in the first half of
+    the holes, black pegs in the second half and the middle hole free. Uses the same memoized search over distinct
+    bit-packed states as countSolutions. Returns the number of states a depth-first search would explore, a
+    dictionary of solution counts indexed by number of moves and the number of distinct states reached, or None if
+    more than max_states distinct states are reached."""
+
+    n = num_holes
+    moves = makeMoves(n, edges, jumps)
+    half = (n - 1) // 2
+    board = sum(1 << i for i in range(half)) | sum(1 << (n + i) for i in range(half + 1, n))
+    target = sum(1 << (n + i) for i in range(half)) | sum(1 << i for i in range(half + 1, n))
+
+    memo = {}
+
+    class TooManyStates(Exception):
+        pass
+
+    def expand(board, free_peg):
+        key = (board, free_peg)
+        if key in memo:
+            return memo[key]
+        if (max_states is not None) and (len(memo) >= max_states):
+            raise TooManyStates()
+
+        if board == target:
+            memo[key] = ({0: 1}, 1)
+            return memo[key]
+
+        counts, numStates = {}, 1
+        for src, cond, mask in moves[free_peg]:
+            if board & cond == cond:
+                child_counts, child_states = expand(board ^ mask, src)
+                numStates += child_states
+                for k, c in child_counts.items():
+                    counts[k + 1] = counts.get(k + 1, 0) + c
+
+        memo[key] = (counts, numStates)
+        return memo[key]
+
+    try:
+        counts, numStatesExplored = expand(board, half)
+    except TooManyStates:
+        return None
+    return numStatesExplored, counts, len(memo)
+
+
+def benchmarkBoards(max_diamonds=6, max_size=5, max_states=2000000):
+    """Solves boards from the peg swap family of increasing size and reports the states explored, solution counts
+    and runtime for each. Larger boards of the same diamond size are skipped once one exceeds max_states."""
+
+    import sys
+    import time
+
+    sys.setrecursionlimit(100000)
+    print("{:>8} {:>4} {:>5} {:>12} {:>24} {:>12} {:>8} {:>10}".format("diamonds", "size", "holes", "distinct",
+        "explored", "solutions", "moves", "time"))
+    for size in range(2, max_size + 1):
+        for num_diamonds in range(2, max_diamonds + 1, 2):
+            px, py, edges, jumps = makeBoard(num_diamonds, size)
+            start_time = time.time()
+            result = countBoardSolutions(len(px), edges, jumps, max_states)
+            runtime = time.time() - start_time
+            if result is None:
+                print("{:>8} {:>4} {:>5} {:>12} {:>24} {:>12} {:>8} {:>9.1f}s".format(num_diamonds, size, len(px),
+                    ">" + str(max_states), "-", "-", "-", runtime))
+                break
+
+            numStatesExplored, counts, numDistinctStates = result
+            moves = "{}-{}".format(min(counts.keys()), max(counts.keys())) if counts else "-"
+            print("{:>8} {:>4} {:>5} {:>12} {:>24} {:>12} {:>8} {:>9.1f}s".format(num_diamonds, size, len(px),
+                numDistinctStates, numStatesExplored, sum(counts.values()), moves, runtime))
+
+
+def getOpenings(state, depth):
+    """Returns the states reached from the given state after depth moves, in the order that a depth-first search
+    would explore them, and the number of states explored before reaching them. Solved states and dead ends
+    found before depth moves are returned as openings too."""
+
+    openings = []
+    numStatesExplored = 0
+    depth += state.num_moves
+    frontier = [state]
+    while frontier:
+        state = frontier.pop()
+        board = board2bits(state.board)
+        moves = [src for src, cond, mask in MOVES[state.free_peg] if board & cond == cond]
+        if (state.num_moves == depth) or (board == TARGET_BITS) or not moves:
+            openings.append(state)
+            continue
+
+        numStatesExplored += 1
+        for src in moves:
+            frontier.append(state.move(src, state.free_peg))
+
+    return openings, numStatesExplored
+
+
+def searchOpening(moves):
+    """Worker for searchParallel. Searches from the state reached by the given (src, dst) moves and returns the
+    number of states explored, solution counts and an example solution (as a list of moves) for each length."""
+
+    numStatesExplored, counts, solutions = searchBitPacked(replayMoves(moves), verbose=False)
+    return numStatesExplored, counts, {n: solutions[n].history()[1][:-1] for n in solutions.keys()}
+
+
+def searchParallel(state, depth=4, workers=None):
+    """Enumerates all solutions from the given state by farming the openings of depth moves out to a pool of worker
+    processes. Results are merged in depth-first search order so the example solutions are the same as a serial
+    search would find regardless of the number of workers."""
+
+    import multiprocessing
+
+    openings, numStatesExplored = getOpenings(state, depth)
+    counts = {}
+    solutions = {}
+    with multiprocessing.Pool(workers) as pool:
+        results = pool.imap(searchOpening, [s.history()[1][:-1] for s in openings], chunksize=1)
+        for i, (n, c, examples) in enumerate(results):
+            numStatesExplored += n
+            for numMoves in sorted(c.keys()):
+                counts[numMoves] = counts.get(numMoves, 0) + c[numMoves]
+                if numMoves not in solutions:
+                    solutions[numMoves] = replayMoves(examples[numMoves])
+            print("\r...{} of {} openings ({}, {})".format(i + 1, len(openings), numStatesExplored,
+                sum(counts.values())), end="")
+    print("")
+
+    return numStatesExplored, counts, solutions
+
+# ----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    import argparse
+    import multiprocessing
+    import time
+
+    parser = argparse.ArgumentParser(description="PEG SWAP: Finds all solutions to the peg swap puzzle.")
+    parser.add_argument('--engine', type=str, default='bits', help='Search engine ("bits", "states", "count" or "parallel").')
+    parser.add_argument('--depth', type=int, default=4, help='Number of opening moves farmed out by the parallel engine.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[None],
+        help='Number of worker processes for the parallel engine (default: number of CPUs). If more than one value is '
+             'given the search is repeated and the runtime reported for each.')
+    parser.add_argument('--benchmark', default=False, action='store_true',
+        help='Count solutions for larger boards from the same family of puzzles and report how the search scales.')
+    parser.add_argument('--max-diamonds', type=int, default=6, help='Largest number of diamonds to benchmark.')
+    parser.add_argument('--max-size', type=int, default=5, help='Largest diamond size to benchmark.')
+    parser.add_argument('--max-states', type=int, default=2000000, help='Distinct state budget for each benchmark.')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmarkBoards(args.max_diamonds, args.max_size, args.max_states)
+        exit(0)
+
+    # force first three moves (the parallel engine searches all openings, including symmetric ones)
+    state = GameState()
+    if args.engine != 'parallel':
+        state = state.move(10, 8)
+        state = state.move(6, 10)
+        state = state.move(8, 6)
+
+    # search for all solutions
+    numDistinctStates = None
+    if args.engine == 'count':
+        numStatesExplored, counts, solutions, numDistinctStates = countSolutions(state)
+    elif args.engine == 'parallel':
+        runtimes = []
+        for workers in args.workers:
+            start_time = time.time()
+            numStatesExplored, counts, solutions = searchParallel(state, args.depth, workers)
+            runtimes.append((workers or multiprocessing.cpu_count(), time.time() - start_time))
+        for workers, runtime in runtimes:
+            print("{} workers: {:.1f}s".format(workers, runtime))
+    else:
+        search = searchBitPacked if args.engine == 'bits' else searchGameStates
+        numStatesExplored, counts, solutions = search(state)
+    numSolutionsFound = sum(counts.values())
+    bestSolutionMoves = min(solutions.keys())
+    bestSolutionFound = solutions[bestSolutionMoves]
+
     # print out the best solution found
     assert bestSolutionFound is not None
     print("\n")
@@ -298,17 +722,23 @@ if __name__ == "__main__":
 
     # print out statistics
     print("{} states explored".format(numStatesExplored))
+    if numDistinctStates is not None:
+        print("{} distinct states reached".format(numDistinctStates))
     print("{} solutions found".format(numSolutionsFound))
+    for numMoves in sorted(counts.keys()):
+        print("  {} solutions with {} moves".format(counts[numMoves], numMoves))
     print("{} moves in best solution".format(bestSolutionMoves))
 
     # write animated gif for each solution
+    renderer = BoardRenderer()
     for numMoves in solutions.keys():
         filename = "peg_swap_{}.gif".format(numMoves)
         print("writing animated GIF to {} ...".format(filename))
         boards, moves = solutions[numMoves].history()
         moves[-1] = None
-        frames = [getBoardAsImage(b, m) for b, m in zip(boards, moves)]
-        imageio.mimsave(filename, frames, duration=0.5)
+        with imageio.get_writer(filename, mode='I', duration=0.5) as writer:
+            for b, m in zip(boards, moves):
+                writer.append_data(renderer.render(b, m))
 
     # write out LaTeX of solutions
     filename = "peg_swap.tex"